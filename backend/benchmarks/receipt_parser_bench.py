@@ -0,0 +1,105 @@
+"""
+Accuracy and speed benchmark for the local receipt parser.
+
+Each receipt in the corpus is a pair of files: <name>.txt with the raw extracted text
+and <name>.json with the expected fields. Run from backend/:
+
+    python -m benchmarks.receipt_parser_bench [corpus_dir] [--runs N]
+
+Add receipts that the parser gets wrong to the corpus before changing the rules.
+"""
+import argparse
+import json
+import os
+import time
+
+from receipt_parser import LOCAL_CONFIDENCE_THRESHOLD, parse_receipt_text, use_local_result
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "receipt_corpus")
+FIELDS = ["shop_name", "date", "currency", "total_amount", "tax_amount", "expense_category"]
+
+
+def _close(a, b) -> bool:
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(a - b) <= 0.01
+    return a == b
+
+
+def load_corpus(corpus_dir: str) -> list:
+    corpus = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.endswith(".txt"):
+            continue
+        base = os.path.join(corpus_dir, name[:-4])
+        with open(base + ".txt", encoding="utf-8") as f:
+            text = f.read()
+        with open(base + ".json", encoding="utf-8") as f:
+            expected = json.load(f)
+        corpus.append((name[:-4], text, expected))
+    return corpus
+
+
+def score(parsed: dict, expected: dict) -> dict:
+    fields = {field: _close(parsed.get(field), expected.get(field)) for field in FIELDS if field in expected}
+    expected_items = [(i["name"], i["amount"]) for i in expected.get("items", [])]
+    parsed_items = [(i["name"], i["amount"]) for i in parsed.get("items", [])]
+    matched = sum(1 for item in expected_items if item in parsed_items)
+    return {
+        "fields": fields,
+        "item_recall": matched / len(expected_items) if expected_items else 1.0,
+        "item_precision": matched / len(parsed_items) if parsed_items else (1.0 if not expected_items else 0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("corpus_dir", nargs="?", default=DEFAULT_CORPUS)
+    parser.add_argument("--runs", type=int, default=1000, help="Parses per receipt for timing")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus_dir)
+    if not corpus:
+        print(f"No receipts found in {args.corpus_dir}")
+        return
+
+    field_hits = {field: [0, 0] for field in FIELDS}
+    recall, precision, fast_path, fast_path_wrong = [], [], 0, 0
+
+    print(f"{'receipt':<24}{'conf':>6}{'fields':>9}{'items R/P':>12}  wrong")
+    for name, text, expected in corpus:
+        parsed = parse_receipt_text(text)
+        result = score(parsed, expected)
+        for field, ok in result["fields"].items():
+            field_hits[field][0] += ok
+            field_hits[field][1] += 1
+        recall.append(result["item_recall"])
+        precision.append(result["item_precision"])
+        wrong = [f for f, ok in result["fields"].items() if not ok]
+        if use_local_result(parsed):
+            fast_path += 1
+            # Wrong fields here reach users without Gemini ever seeing the receipt
+            fast_path_wrong += bool(wrong)
+
+        correct = len(result["fields"]) - len(wrong)
+        print(f"{name:<24}{parsed['confidence']:>6.2f}{correct:>5}/{len(result['fields']):<3}"
+              f"{result['item_recall']:>6.2f}/{result['item_precision']:.2f}  {', '.join(wrong)}")
+
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        for _, text, _ in corpus:
+            parse_receipt_text(text)
+    per_parse_us = (time.perf_counter() - start) / (args.runs * len(corpus)) * 1e6
+
+    print()
+    for field, (hits, total) in field_hits.items():
+        if total:
+            print(f"{field:<18}{hits}/{total} ({hits / total:.0%})")
+    print(f"{'item recall':<18}{sum(recall) / len(recall):.0%}")
+    print(f"{'item precision':<18}{sum(precision) / len(precision):.0%}")
+    print(f"{'fast path':<18}{fast_path}/{len(corpus)} at confidence >= {LOCAL_CONFIDENCE_THRESHOLD} with consistent totals")
+    print(f"{'fast path wrong':<18}{fast_path_wrong}/{fast_path}")
+    print(f"{'mean parse time':<18}{per_parse_us:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
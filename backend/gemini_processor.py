@@ -1,12 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 from google.generativeai import GenerativeModel
 import os
 
+from receipt_parser import parse_receipt_text, use_local_result
+
 # Ensure you set your environment variable or replace with actual key
 # os.environ["GOOGLE_API_KEY"] = "<YOUR API Key>"
 
-model = GenerativeModel(model_name="models/gemini-2.0-flash")
+_model = None
+
+def get_model() -> GenerativeModel:
+    """Builds the Gemini model on first use so importing this module stays cheap."""
+    global _model
+    if _model is None:
+        _model = GenerativeModel(model_name="models/gemini-2.0-flash")
+    return _model
+
+# Background Gemini calls that enrich a provisional local result
+_enrichment_pool = ThreadPoolExecutor(max_workers=4)
 
 def process_with_gemini(extracted_text: str) -> dict:
+    """
+    Returns structured receipt data, trying the local parser before the model:
+    - When the local parse is confident enough it is returned at once, marked
+      "provisional". Pass it to enrich_in_background once it is saved to have
+      Gemini fill in the expense category and reimbursable items.
+    - Otherwise Gemini is called inline and its output is merged with the local parse.
+    """
+    local = parse_receipt_text(extracted_text)
+    if use_local_result(local):
+        return {**local, "reimbursable_items": [], "source": "local", "provisional": True}
+    return merge_results(local, ask_gemini(extracted_text))
+
+def needs_enrichment(result: dict) -> bool:
+    return result.get("source") == "local" and result.get("provisional") and "enrichment_error" not in result
+
+def enrich_in_background(extracted_text: str, provisional: dict, on_enriched: Callable[[dict], None]):
+    """
+    Runs Gemini for a provisional result and passes the merged result to on_enriched.
+    Call it only after the provisional result is saved, so the enriched one lands last.
+    """
+    _enrichment_pool.submit(_enrich, extracted_text, provisional, on_enriched)
+
+def _enrich(extracted_text: str, provisional: dict, on_enriched: Callable[[dict], None]):
+    try:
+        on_enriched(merge_results(provisional, ask_gemini(extracted_text)))
+    except Exception as e:
+        print("Enrichment error:", e)
+
+def merge_results(local: dict, gemini: dict) -> dict:
+    """Local values for the fields it parses (amounts, date, merchant), Gemini's for the rest."""
+    if "error" in gemini:
+        return {**local, "source": "local", "provisional": True, "enrichment_error": gemini["error"]}
+    items = local.get("items") or [{"name": name} for name in gemini.get("items", [])]
+    return {
+        **local,
+        "items": items,
+        "expense_category": gemini.get("expense_category") or local.get("expense_category"),
+        "reimbursable_items": gemini.get("reimbursable_items", []),
+        "source": "local+gemini" if local.get("items") else "gemini",
+        "provisional": False,
+    }
+
+def ask_gemini(extracted_text: str) -> dict:
     """
     Sends the extracted receipt text to Gemini and returns structured data:
     - List of items
@@ -33,7 +90,7 @@ def process_with_gemini(extracted_text: str) -> dict:
     }}
     """
 
-    response = model.generate_content(prompt)
+    response = get_model().generate_content(prompt)
 
     # Attempt to parse JSON
     try:
@@ -1,10 +1,91 @@
 from firebase_admin import credentials, storage, firestore
 import firebase_admin
+import threading
+import time
 
-# Firebase init
-cred = credentials.Certificate("secrets/mugiwara-no-ichimi-firebase-adminsdk-fbsvc-6bf822a736.json")
-firebase_admin.initialize_app(cred, {
-    'storageBucket': 'mugiwara-no-ichimi.firebasestorage.app'
-})
-bucket = storage.bucket()
-db = firestore.client()
\ No newline at end of file
+CREDENTIALS_PATH = "secrets/mugiwara-no-ichimi-firebase-adminsdk-fbsvc-6bf822a736.json"
+STORAGE_BUCKET = "mugiwara-no-ichimi.firebasestorage.app"
+
+# Firebase clients are created on first use instead of at import time so the
+# process can start serving /ping before paying for credentials and channels.
+_lock = threading.Lock()
+_app = None
+_bucket = None
+_db = None
+
+# Seconds spent in each startup phase, e.g. {"firebase_app": 0.41, "warm_up": 0.22}
+_startup_timings = {}
+_started_at = time.perf_counter()
+
+
+def record_timing(phase: str, seconds: float):
+    _startup_timings[phase] = round(seconds, 4)
+
+
+def get_app():
+    global _app
+    if _app is None:
+        with _lock:
+            if _app is None:
+                start = time.perf_counter()
+                cred = credentials.Certificate(CREDENTIALS_PATH)
+                _app = firebase_admin.initialize_app(cred, {
+                    'storageBucket': STORAGE_BUCKET
+                })
+                record_timing("firebase_app", time.perf_counter() - start)
+    return _app
+
+
+def get_bucket():
+    global _bucket
+    if _bucket is None:
+        app = get_app()
+        with _lock:
+            if _bucket is None:
+                start = time.perf_counter()
+                _bucket = storage.bucket(app=app)
+                record_timing("storage_client", time.perf_counter() - start)
+    return _bucket
+
+
+def get_db():
+    global _db
+    if _db is None:
+        app = get_app()
+        with _lock:
+            if _db is None:
+                start = time.perf_counter()
+                _db = firestore.client(app=app)
+                record_timing("firestore_client", time.perf_counter() - start)
+    return _db
+
+
+def warm_up():
+    """
+    Builds every client and issues one cheap call on each so the Firestore
+    gRPC channel and the Storage HTTP connection pool are open before the
+    instance reports ready. Failures are logged, not raised, so a flaky
+    dependency does not keep the instance from starting.
+    """
+    start = time.perf_counter()
+    try:
+        get_db().collection("users").limit(1).get()
+    except Exception as e:
+        print(f"Firestore warm-up failed: {e}")
+    try:
+        get_bucket().reload()
+    except Exception as e:
+        print(f"Storage warm-up failed: {e}")
+    record_timing("warm_up", time.perf_counter() - start)
+
+
+def startup_report() -> dict:
+    return {
+        "uptime_seconds": round(time.perf_counter() - _started_at, 3),
+        "timings": dict(_startup_timings),
+        "initialized": {
+            "firebase_app": _app is not None,
+            "storage": _bucket is not None,
+            "firestore": _db is not None,
+        },
+    }
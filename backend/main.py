@@ -1,11 +1,59 @@
+import time
+_import_start = time.perf_counter()
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from routes import default, chatbot, geminiADK
+from init import record_timing, warm_up
+from routes import default, chatbot, geminiADK, export, similar, events, ingest
+from services.access_tracker import receipt_access
+from services.events import hub
+from services.expiry import sweep_expired_receipts
 # from routes.geminiADK.smart_actions import router as smart_actions_router
 
+record_timing("imports", time.perf_counter() - _import_start)
+
+# Set WARM_UP_ON_STARTUP=true to open Firebase connections before readiness.
+# Left off by default so cold starts serve /ping as soon as possible.
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "false").lower() == "true"
+
+# Seconds between receipt expiry sweeps in this process; 0 disables the in-process
+# sweeper (e.g. when `python -m services.expiry` runs from Cloud Scheduler instead).
+EXPIRY_SWEEP_INTERVAL_SECONDS = int(os.getenv("EXPIRY_SWEEP_INTERVAL_SECONDS", "0"))
+
+
+async def run_expiry_sweeper(interval: int):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(sweep_expired_receipts)
+        except Exception as e:
+            print(f"Expiry sweep failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARM_UP_ON_STARTUP:
+        await asyncio.to_thread(warm_up)
+
+    background = [asyncio.create_task(receipt_access.run())]
+    if EXPIRY_SWEEP_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(run_expiry_sweeper(EXPIRY_SWEEP_INTERVAL_SECONDS)))
+
+    yield
+
+    for task in background:
+        task.cancel()
+    # Lets the access tracker write its last buffered access times
+    await asyncio.gather(*background, return_exceptions=True)
+    hub.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for Flutter
 app.add_middleware(
@@ -19,3 +67,7 @@ app.add_middleware(
 app.include_router(default.router)
 app.include_router(chatbot.router)
 app.include_router(geminiADK.router)
+app.include_router(export.router)
+app.include_router(similar.router)
+app.include_router(events.router)
+app.include_router(ingest.router)
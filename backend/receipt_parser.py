@@ -0,0 +1,239 @@
+import os
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+# Rule-based parser for common receipt layouts. It produces the basics (merchant,
+# date, currency, totals, line items) in well under a millisecond, with a confidence
+# score that decides whether the Gemini call is still needed up front.
+
+_AMOUNT = r"(?P<amount>-?\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|-?\d+(?:\.\d{1,2})?)"
+_CURRENCY_PREFIX = r"(?:₹|rs\.?|inr|\$|usd|€|eur|£|gbp)?"
+
+AMOUNT_AT_END = re.compile(_CURRENCY_PREFIX + r"\s*" + _AMOUNT + r"\s*$", re.IGNORECASE)
+
+CURRENCY_PATTERNS = [
+    ("INR", re.compile(r"₹|\brs\.?\s*\d|\binr\b", re.IGNORECASE)),
+    ("USD", re.compile(r"\$|\busd\b", re.IGNORECASE)),
+    ("EUR", re.compile(r"€|\beur\b", re.IGNORECASE)),
+    ("GBP", re.compile(r"£|\bgbp\b", re.IGNORECASE)),
+]
+
+# Checked in order: the first kind with a match wins, the last match of it is used
+TOTAL_PATTERNS = [
+    re.compile(r"^\s*(grand\s*total|net\s*payable|amount\s*payable|amount\s*due|balance\s*due)\b", re.IGNORECASE),
+    re.compile(r"^\s*(total\s*amount|net\s*amount|bill\s*amount|total\s*\(?(inr|rs|usd)\)?)\b", re.IGNORECASE),
+    re.compile(r"^\s*total\b", re.IGNORECASE),
+]
+# Total-looking lines that are counts or savings ("Total Items: 2", "Total Qty 3", "Total Savings")
+TOTAL_EXCLUDE = re.compile(r"\b(items?|qty|quantity|savings|saved)\b", re.IGNORECASE)
+SUBTOTAL = re.compile(r"^\s*(sub\s*-?\s*total|taxable\s*(value|amount))\b", re.IGNORECASE)
+TAX = re.compile(r"^\s*(c\s*gst|s\s*gst|i\s*gst|u\s*gst|gst|vat|service\s*tax|sales\s*tax|tax)\b", re.IGNORECASE)
+# Tax-looking lines that carry no tax amount ("Tax Invoice No 123", "Total incl. tax")
+TAX_EXCLUDE = re.compile(r"\b(total|invoice|incl|inclusive|no|number|reg)\b", re.IGNORECASE)
+
+# Lines that are never line items
+NON_ITEM = re.compile(
+    r"\b(total|sub\s*total|tax|gst|vat|cash|change|card|upi|paid|payment|balance|round\s*off|"
+    r"discount|savings|tender|invoice|bill\s*no|gstin|phone|tel|date|time|table|cashier|qty|rate)\b",
+    re.IGNORECASE,
+)
+ITEM_LINE = re.compile(
+    r"^\s*(?P<name>.*?[A-Za-z].*?)\s+"
+    r"(?:(?P<qty>\d+(?:\.\d+)?)\s*(?:x|@|\*)?\s+(?P<unit>\d[\d,]*\.\d{2})\s+)?"
+    + _CURRENCY_PREFIX + r"\s*(?P<amount>\d[\d,]*\.\d{2})\s*$",
+    re.IGNORECASE,
+)
+
+_MONTHS = "jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec"
+DATE_PATTERNS = [
+    (re.compile(r"\b(?P<y>\d{4})[-/.](?P<m>\d{1,2})[-/.](?P<d>\d{1,2})\b"), "ymd"),
+    (re.compile(r"\b(?P<a>\d{1,2})[-/.](?P<b>\d{1,2})[-/.](?P<y>\d{4}|\d{2})\b"), "ab_y"),
+    (re.compile(r"\b(?P<d>\d{1,2})[\s-](?P<mon>" + _MONTHS + r")[a-z]*[\s,-]+(?P<y>\d{4}|\d{2})\b", re.IGNORECASE), "d_mon_y"),
+    (re.compile(r"\b(?P<mon>" + _MONTHS + r")[a-z]*\s+(?P<d>\d{1,2}),?\s+(?P<y>\d{4})\b", re.IGNORECASE), "mon_d_y"),
+]
+
+# Currencies of the countries that write numeric dates month first (04/05/2025 = April 5)
+MONTH_FIRST_CURRENCIES = {"USD"}
+
+MERCHANT_SKIP = re.compile(
+    r"\b(tax\s*invoice|invoice|receipt|bill|gstin|fssai|phone|ph|tel|mob|www|http|date|cashier|welcome)\b",
+    re.IGNORECASE,
+)
+
+CATEGORY_KEYWORDS = [
+    ("Food", re.compile(r"\b(restaurant|cafe|caf[eé]|coffee|diner|bakery|pizza|burger|kitchen|dhaba|biryani|food|swiggy|zomato)\b", re.IGNORECASE)),
+    ("Groceries", re.compile(r"\b(mart|supermarket|grocery|grocer|fresh|bazaar|provision|dmart|kirana)\b", re.IGNORECASE)),
+    ("Travel", re.compile(r"\b(fuel|petrol|diesel|uber|ola|taxi|cab|airline|airways|railway|irctc|parking|toll)\b", re.IGNORECASE)),
+    ("Health", re.compile(r"\b(pharmacy|chemist|medical|medicals|hospital|clinic|apollo)\b", re.IGNORECASE)),
+    ("Electronics", re.compile(r"\b(electronics|mobile|digital|croma|reliance\s*digital|laptop)\b", re.IGNORECASE)),
+    ("Shopping", re.compile(r"\b(fashion|apparel|clothing|footwear|lifestyle|store)\b", re.IGNORECASE)),
+]
+
+# Confidence weights; they add up to 1.0
+WEIGHTS = {"total": 0.35, "date": 0.15, "merchant": 0.15, "items": 0.2, "consistent": 0.15}
+
+# At or above this confidence, with items that add up to the total, the local result
+# is returned without waiting for Gemini (see use_local_result)
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_PARSER_CONFIDENCE_THRESHOLD", "0.8"))
+
+
+def _to_float(value: str) -> float:
+    return float(value.replace(",", ""))
+
+
+def _line_amount(line: str) -> Optional[float]:
+    # A trailing percentage ("GST 5%") is a rate, not an amount
+    if line.rstrip().endswith("%"):
+        return None
+    match = AMOUNT_AT_END.search(line)
+    return _to_float(match.group("amount")) if match else None
+
+
+def _year(value: str) -> int:
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _month(name: str) -> int:
+    return datetime.strptime(name[:3].title(), "%b").month
+
+
+def parse_date(text: str, currency: Optional[str] = None) -> Tuple[Optional[str], bool]:
+    """
+    Returns (YYYY-MM-DD, certain) for the first date found, or (None, False). Numeric
+    dates are read month first on USD receipts and day first otherwise; without a
+    currency to go by, a date like 04/05/2025 is read day first but is not certain.
+    """
+    for pattern, kind in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            certain = True
+            try:
+                if kind == "ymd":
+                    date = datetime(int(match["y"]), int(match["m"]), int(match["d"]))
+                elif kind == "ab_y":
+                    a, b = int(match["a"]), int(match["b"])
+                    if a > 12 or b > 12:
+                        # Only one order is possible
+                        day, month = (a, b) if a > 12 else (b, a)
+                    elif currency in MONTH_FIRST_CURRENCIES:
+                        month, day = a, b
+                    else:
+                        day, month = a, b
+                        certain = a == b or currency is not None
+                    date = datetime(_year(match["y"]), month, day)
+                else:
+                    date = datetime(_year(match["y"]), _month(match["mon"]), int(match["d"]))
+            except ValueError:
+                continue
+            return date.strftime("%Y-%m-%d"), certain
+    return None, False
+
+
+def parse_currency(text: str) -> Optional[str]:
+    for code, pattern in CURRENCY_PATTERNS:
+        if pattern.search(text):
+            return code
+    return None
+
+
+def parse_merchant(lines: List[str]) -> Optional[str]:
+    for line in lines[:6]:
+        candidate = line.strip(" *=-_#:")
+        letters = sum(ch.isalpha() for ch in candidate)
+        if letters < 3 or letters < len(candidate) * 0.5:
+            continue
+        if MERCHANT_SKIP.search(candidate):
+            continue
+        return candidate
+    return None
+
+
+def guess_category(merchant: Optional[str], items: List[dict]) -> Optional[str]:
+    haystack = " ".join([merchant or ""] + [item["name"] for item in items])
+    for category, pattern in CATEGORY_KEYWORDS:
+        if pattern.search(haystack):
+            return category
+    return None
+
+
+def parse_receipt_text(text: str) -> dict:
+    """
+    Parses raw receipt text. Returns the structured fields found plus "confidence"
+    (0-1); fields that could not be read are None (or an empty items list).
+    """
+    lines = [line for line in (text or "").splitlines() if line.strip()]
+
+    total = None
+    for pattern in TOTAL_PATTERNS:
+        amounts = [
+            _line_amount(line) for line in lines
+            if pattern.search(line) and not SUBTOTAL.search(line) and not TOTAL_EXCLUDE.search(line)
+        ]
+        amounts = [amount for amount in amounts if amount is not None]
+        if amounts:
+            total = amounts[-1]
+            break
+
+    subtotal = next((a for a in (_line_amount(l) for l in lines if SUBTOTAL.search(l)) if a is not None), None)
+    taxes = [_line_amount(l) for l in lines if TAX.search(l) and not TAX_EXCLUDE.search(l)]
+    taxes = [a for a in taxes if a is not None]
+    tax = round(sum(taxes), 2) if taxes else None
+
+    items = []
+    for line in lines:
+        if NON_ITEM.search(line) or TAX.search(line) or SUBTOTAL.search(line):
+            continue
+        if any(pattern.search(line) for pattern in TOTAL_PATTERNS):
+            continue
+        match = ITEM_LINE.match(line)
+        if not match:
+            continue
+        name = re.sub(r"^\d+[.)]\s*", "", match["name"]).strip(" .:-")
+        if len(name) < 2:
+            continue
+        item = {"name": name, "amount": _to_float(match["amount"])}
+        if match["qty"]:
+            item["quantity"] = float(match["qty"])
+            item["unit_price"] = _to_float(match["unit"])
+        items.append(item)
+
+    merchant = parse_merchant(lines)
+    currency = parse_currency(text or "")
+    date, date_certain = parse_date(text or "", currency)
+
+    items_sum = round(sum(item["amount"] for item in items), 2)
+    consistent = False
+    if items and total is not None:
+        expected = [total, subtotal, total - (tax or 0)]
+        consistent = any(value and abs(items_sum - value) <= max(0.01 * value, 0.05) for value in expected)
+
+    confidence = (
+        WEIGHTS["total"] * (total is not None)
+        # A date whose day/month order was guessed does not count
+        + WEIGHTS["date"] * date_certain
+        + WEIGHTS["merchant"] * (merchant is not None)
+        + WEIGHTS["items"] * bool(items)
+        + WEIGHTS["consistent"] * consistent
+    )
+
+    return {
+        "shop_name": merchant,
+        "date": date,
+        "currency": currency,
+        "total_amount": total,
+        "subtotal": subtotal,
+        "tax_amount": tax,
+        "items": items,
+        "expense_category": guess_category(merchant, items),
+        "confidence": round(confidence, 2),
+        "totals_consistent": consistent,
+    }
+
+
+def use_local_result(parsed: dict) -> bool:
+    """
+    Whether a parse can be used without Gemini. Confidence alone is not enough: a
+    wrong total still scores 0.85, so the items must also add up to it.
+    """
+    return parsed["totals_consistent"] and parsed["confidence"] >= LOCAL_CONFIDENCE_THRESHOLD
@@ -7,24 +7,30 @@ from firebase_admin import firestore
 import uuid
 import json
 import re
-from datetime import datetime
+from datetime import datetime, timezone
 from fastapi import Query
 
 from models.models import *
 from services.default import parse_date
-from init import bucket, db
+from services.chat_sessions import create_session, get_session, send_message
+from services.receipts import stream_user_receipts
+from init import get_db
 
 router = APIRouter(tags=["Chatbot"])
 
 @router.post("/chat")
-def chat_with_bot(user_id: str = Query(..., description="User ID from OAuth"), prompt: str = Query(..., description="User's prompt for the chatbot")):
+def chat_with_bot(
+    user_id: str = Query(..., description="User ID from OAuth"),
+    prompt: str = Query(..., description="User's prompt for the chatbot"),
+    wait: bool = Query(True, description="Wait for the reply; with false, only the message ID is returned and the reply is pushed over /ws"),
+):
     """
     Endpoint to chat with the bot.
     It processes the user's prompt and returns a response.
     """
     try:
         # Fetch user info
-        user_doc_ref = db.collection("users").document(user_id)
+        user_doc_ref = get_db().collection("users").document(user_id)
         user_doc = user_doc_ref.get()
 
         if not user_doc.exists:
@@ -34,10 +40,8 @@ def chat_with_bot(user_id: str = Query(..., description="User ID from OAuth"), p
         user_name = user_data.get("user_name", "Anonymous")
         user_email = user_data.get("user_email", "")
 
-        receipts = db.collection("extracted_texts").where(filter=FieldFilter("user_id", "==", user_id)).stream()
         receipt_texts = []
-        for doc in receipts:
-            receipt = doc.to_dict()
+        for _, receipt in stream_user_receipts(user_id):
             structured_output = receipt.get("structured_output")
             if not structured_output:
                 continue
@@ -50,7 +54,10 @@ def chat_with_bot(user_id: str = Query(..., description="User ID from OAuth"), p
                 receipt_texts.append(parsed_output)
         print(receipt_texts)
         # Process the prompt (this is a placeholder for actual processing logic)
-        _, ref = db.collection("messages").add({
+        _, ref = get_db().collection("messages").add({
+            # Lets /ws listen for this user's replies
+            "user_id": user_id,
+            "created_at": datetime.now(timezone.utc),
             # "prompt": f"Based on this context: {receipt_texts}, respond only to this prompt: {prompt}",
             "prompt" : f"""
                 You are Luffy, an intelligent assistant helping users manage their receipts and spending. 
@@ -73,6 +80,9 @@ def chat_with_bot(user_id: str = Query(..., description="User ID from OAuth"), p
 
         })
         new_doc_id = ref.id
+        if not wait:
+            return JSONResponse(status_code=202, content={"message_id": new_doc_id})
+
         max_polling_attempts = 30  # Max number of times to check (e.g., 30 attempts)
         polling_interval_seconds = 1 # How long to wait between checks (e.g., 2 seconds)
                                      # Total wait time: 30 * 2 = 60 seconds
@@ -117,4 +127,49 @@ def chat_with_bot(user_id: str = Query(..., description="User ID from OAuth"), p
 
     except Exception as e:
         print(f"Error in chat_with_bot: {e}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/chat/sessions")
+def start_chat_session(user_id: str = Query(..., description="User ID from OAuth")):
+    """
+    Starts a chat session. The user's receipt context is built once per session and
+    reused across turns until their receipts change.
+    """
+    user_doc = get_db().collection("users").document(user_id).get()
+    if not user_doc.exists:
+        return JSONResponse(status_code=404, content={"error": "User not found"})
+    return {"session_id": create_session(user_id)}
+
+
+@router.post("/chat/sessions/{session_id}/messages")
+def chat_in_session(
+    session_id: str,
+    user_id: str = Query(..., description="User ID from OAuth"),
+    prompt: str = Query(..., description="User's prompt for the chatbot"),
+):
+    session_ref, session_data = get_session(session_id, user_id)
+    if session_ref is None:
+        return JSONResponse(status_code=404, content={"error": "Chat session not found"})
+    try:
+        return send_message(session_id, session_ref, session_data, prompt)
+    except Exception as e:
+        print(f"Error in chat_in_session: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/chat/sessions/{session_id}")
+def get_chat_session(session_id: str, user_id: str = Query(..., description="User ID from OAuth")):
+    session_ref, session_data = get_session(session_id, user_id)
+    if session_ref is None:
+        return JSONResponse(status_code=404, content={"error": "Chat session not found"})
+
+    turns = session_ref.collection("turns").order_by("created_at").stream()
+    return {
+        "session_id": session_id,
+        "turn_count": session_data.get("turn_count", 0),
+        "turns": [
+            {"role": t.get("role"), "text": t.get("text"), "created_at": t.get("created_at").isoformat()}
+            for t in (doc.to_dict() for doc in turns)
+        ],
+    }
@@ -2,14 +2,20 @@ from fastapi import APIRouter
 from fastapi import File, HTTPException, UploadFile
 from fastapi.responses import JSONResponse
 from firebase_admin import firestore
+import asyncio
 import uuid
 import json
 import re
 from datetime import datetime
+from typing import Optional
 from fastapi import Query
 from models.models import *
 from services.default import parse_date, update_extracted_text
-from init import bucket, db
+from services.similarity import index_receipt
+from services.singleflight import flights, single_flight
+from services.access_tracker import receipt_access
+from services.receipts import get_receipt, stream_all_receipts
+from init import get_bucket, get_db, startup_report
 
 router = APIRouter(tags=["Default"])
 
@@ -20,6 +26,16 @@ router = APIRouter(tags=["Default"])
 def ping():
     return {"message": "Backend is alive!"}
 
+@router.get("/startup-report")
+def get_startup_report():
+    """Import and client init costs of this instance, in seconds."""
+    return startup_report()
+
+@router.get("/coalescing-stats")
+def get_coalescing_stats():
+    """Per-route counts of calls, calls actually executed and duplicates that shared an in-flight result."""
+    return flights.stats()
+
 @router.post("/upload")
 async def upload_image(user_id: str = Query(..., description="User ID from OAuth"),file: UploadFile = File(...)):
     try:
@@ -30,14 +46,26 @@ async def upload_image(user_id: str = Query(..., description="User ID from OAuth
 
         filename = f"receipts/{uuid.uuid4()}_{original_filename}"
 
-        blob = bucket.blob(filename)
+        blob = get_bucket().blob(filename)
         blob.upload_from_string(content, content_type=file.content_type)
 
         # Optional: make file public or return URL
         blob.make_public()
 
         receipt_id = update_extracted_text(user_id,blob.public_url)
-        return {"receipt_id":receipt_id,"fetched_at": datetime.utcnow().isoformat() + "Z","data" : get_structured_data(receipt_id)}
+        # In a thread: when a concurrent GET for this receipt leads the single flight,
+        # waiting for it must not block the event loop
+        data = await asyncio.to_thread(get_structured_data, receipt_id, user_id)
+
+        # Keep the similar-purchase index current; a failure here must not fail the upload
+        if isinstance(receipt_id, str):
+            try:
+                receipt_doc = get_receipt(receipt_id, user_id)
+                index_receipt(user_id, receipt_id, receipt_doc.to_dict())
+            except Exception as e:
+                print(f"Error indexing receipt {receipt_id}: {e}")
+
+        return {"receipt_id":receipt_id,"fetched_at": datetime.utcnow().isoformat() + "Z","data" : data}
         # return {"message": "Uploaded", "url": blob.public_url, "reciept":reciept["receipt_id"]}
     except Exception as e:
         print("error ")
@@ -46,18 +74,19 @@ async def upload_image(user_id: str = Query(..., description="User ID from OAuth
 
 
 @router.get("/receipt/{doc_id}")
-def get_structured_data(doc_id: str):
-    doc_ref = db.collection("extracted_texts").document(doc_id)
-    doc = doc_ref.get()
+@single_flight("receipt")
+def get_structured_data(doc_id: str, user_id: Optional[str] = Query(None, description="Owner's user ID, to read from users/{uid}/receipts directly")):
+    doc = get_receipt(doc_id, user_id)
 
-    if not doc.exists:
+    if doc is None:
         return JSONResponse(status_code=404, content={"error": "Not found"})
 
     raw_output = doc.to_dict().get("structured_output", "")
 
-    # Update timestamp only if structured_output exists
+    # Reads stay read-only: the access time is buffered and written as
+    # last_accessed_at in batches, leaving "timestamp" to ingest
     if raw_output:
-        doc_ref.update({"timestamp": firestore.SERVER_TIMESTAMP})
+        receipt_access.record(doc_id, doc.to_dict().get("user_id"))
 
     # Remove ```json\n...\n``` if needed
     cleaned_output = re.sub(r"^```json\n(.*?)\n```$", r"\1", raw_output.strip(), flags=re.DOTALL)
@@ -72,13 +101,11 @@ def get_structured_data(doc_id: str):
 @router.get("/debug-all")
 def debug_all_receipts():
     try:
-        docs = db.collection("extracted_texts").stream()
         all_receipts = []
 
-        for doc in docs:
-            data = doc.to_dict()
+        for doc_id, data in stream_all_receipts():
             all_receipts.append({
-                "doc_id": doc.id,
+                "doc_id": doc_id,
                 "data": data
             })
         return all_receipts
@@ -186,7 +213,7 @@ async def save_user_preferences(payload: PreferencesPayload):
             user_preferences_doc["preferences"][key] = preference_data
 
         # Save to Firestore
-        db.collection("user_preferences").document(preference_id).set(user_preferences_doc)
+        get_db().collection("user_preferences").document(preference_id).set(user_preferences_doc)
         print(f"Saved preferences successfully with ID: {preference_id}")
 
         return UserPreferencesResponse(
@@ -207,7 +234,7 @@ async def save_user_preferences(payload: PreferencesPayload):
 async def get_user_preferences(user_id: str = Query(..., description="User ID to fetch preferences for")):
     try:
         # Query Firestore collection for user_id
-        docs = db.collection("user_preferences").where("user_id", "==", user_id).stream()
+        docs = get_db().collection("user_preferences").where("user_id", "==", user_id).stream()
         
         user_preferences = None
         for doc in docs:
@@ -0,0 +1,40 @@
+import asyncio
+
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect
+
+from services.events import CLIENT_QUEUE_SIZE, hub
+
+router = APIRouter(tags=["Events"])
+
+
+@router.websocket("/ws")
+async def user_events(websocket: WebSocket, user_id: str = Query(..., description="User ID from OAuth")):
+    """
+    Pushes receipt_extracted, smart_actions_ready and chat_reply events for the user
+    as JSON messages, in place of polling /latest-receipt and /receipt/{id}.
+    """
+    await websocket.accept()
+    queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    # Opening and closing Firestore listeners blocks, so it stays off the event loop
+    await asyncio.to_thread(hub.connect, user_id, queue, asyncio.get_running_loop())
+
+    async def send_events():
+        while True:
+            await websocket.send_json(await queue.get())
+
+    async def receive_until_closed():
+        # Clients may send anything (e.g. keep-alive pings); it is ignored
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_until_closed())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                print(f"WebSocket for {user_id} closed with error: {error}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.to_thread(hub.disconnect, user_id, queue)
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from firebase_admin import firestore
+
+from init import get_bucket, get_db
+from services.export import EXPORT_FORMATS, export_receipts
+
+router = APIRouter(tags=["Export"])
+
+DOWNLOAD_LINK_TTL = timedelta(days=1)
+
+
+def _parse_filter_date(value: Optional[str], name: str, end_of_day: bool = False) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected YYYY-MM-DD")
+    if end_of_day:
+        parsed = parsed.replace(hour=23, minute=59, second=59)
+    return parsed
+
+
+def write_export_to_storage(export_id: str, user_id: str, export_format: str, start_date, end_date, category):
+    """Renders an export to a temp file, uploads it and records the download link on the export document."""
+    export_ref = get_db().collection("exports").document(export_id)
+    extension = EXPORT_FORMATS[export_format]["extension"]
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=f".{extension}", delete=False) as tmp:
+            tmp_path = tmp.name
+            for chunk in export_receipts(user_id, export_format, start_date, end_date, category):
+                tmp.write(chunk)
+
+        blob = get_bucket().blob(f"exports/{user_id}/{export_id}.{extension}")
+        blob.upload_from_filename(tmp_path, content_type=EXPORT_FORMATS[export_format]["media_type"])
+        download_url = blob.generate_signed_url(expiration=DOWNLOAD_LINK_TTL)
+
+        export_ref.update({
+            "status": {"state": "COMPLETED", "completeTime": firestore.SERVER_TIMESTAMP},
+            "download_url": download_url,
+            "size_bytes": blob.size,
+        })
+        print(f"✅ Export {export_id} written for user {user_id}")
+    except Exception as e:
+        print(f"Error writing export {export_id}: {e}")
+        export_ref.update({"status": {"state": "ERROR", "error": str(e)}})
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@router.get("/export")
+def export_user_receipts(
+    background_tasks: BackgroundTasks,
+    user_id: str = Query(..., description="User ID from OAuth"),
+    format: str = Query("csv", description="One of csv, ndjson, pdf"),
+    start_date: Optional[str] = Query(None, description="Only receipts on or after this date (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="Only receipts on or before this date (YYYY-MM-DD)"),
+    category: Optional[str] = Query(None, description="Only receipts with this expense_category"),
+    background: bool = Query(False, description="Write the export to storage and return a download link"),
+):
+    """
+    Streams all of a user's receipts in the requested format. With background=true the
+    export is written to storage instead and can be picked up from /export/{export_id}.
+    """
+    export_format = format.lower()
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+
+    start = _parse_filter_date(start_date, "start_date")
+    end = _parse_filter_date(end_date, "end_date", end_of_day=True)
+
+    if background:
+        export_id = str(uuid.uuid4())
+        get_db().collection("exports").document(export_id).set({
+            "export_id": export_id,
+            "user_id": user_id,
+            "format": export_format,
+            "filters": {"start_date": start_date, "end_date": end_date, "category": category},
+            "status": {"state": "PROCESSING", "startTime": firestore.SERVER_TIMESTAMP},
+        })
+        background_tasks.add_task(write_export_to_storage, export_id, user_id, export_format, start, end, category)
+        return {"export_id": export_id, "status": "PROCESSING", "status_url": f"/export/{export_id}"}
+
+    filename = f"receipts_{datetime.utcnow().strftime('%Y%m%d')}.{EXPORT_FORMATS[export_format]['extension']}"
+    return StreamingResponse(
+        export_receipts(user_id, export_format, start, end, category),
+        media_type=EXPORT_FORMATS[export_format]["media_type"],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/export/{export_id}")
+def get_export_status(export_id: str, user_id: str = Query(..., description="User ID from OAuth")):
+    export_doc = get_db().collection("exports").document(export_id).get()
+    if not export_doc.exists or export_doc.to_dict().get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Export not found")
+
+    data = export_doc.to_dict()
+    return {
+        "export_id": export_id,
+        "format": data.get("format"),
+        "status": data.get("status", {}).get("state"),
+        "download_url": data.get("download_url"),
+        "error": data.get("status", {}).get("error"),
+    }
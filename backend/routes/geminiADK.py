@@ -4,14 +4,21 @@ import google.generativeai as genai
 import json
 import os
 from datetime import datetime
-from init import db
+from services.receipts import get_receipt
+from services.singleflight import single_flight
 import re
 
 router = APIRouter(tags=["Smart Actions"])
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("gemini-1.5-flash")
+# Gemini is configured and the model built on first use, not at import
+_model = None
+
+def get_model():
+    global _model
+    if _model is None:
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        _model = genai.GenerativeModel("gemini-1.5-flash")
+    return _model
 
 def convert_firestore_data(data):
     """Recursively convert Firestore data to JSON-serializable types."""
@@ -25,14 +32,15 @@ def convert_firestore_data(data):
         return data
 
 @router.get("/smart-actions")
+@single_flight("smart-actions")
 async def get_smart_actions(
     receipt_id: str = Query(..., description="Receipt ID from extracted_texts collection"),
     user_id: str = Query(..., description="User ID for validation")
 ):
     try:
         # Fetch document
-        receipt_doc = db.collection("extracted_texts").document(receipt_id).get()
-        if not receipt_doc.exists:
+        receipt_doc = get_receipt(receipt_id, user_id)
+        if receipt_doc is None:
             raise HTTPException(status_code=404, detail="Receipt not found")
 
         receipt_data = convert_firestore_data(receipt_doc.to_dict())
@@ -98,7 +106,7 @@ user_preferences:
     """
 
     try:
-        response = model.generate_content(prompt)
+        response = get_model().generate_content(prompt)
         response_text = response.text.strip()
 
         # Strip Markdown if needed
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import re
+
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from fastapi.responses import JSONResponse
+
+from services.ingest_queue import QueueFull, get_queue, spool_path, spool_upload
+
+router = APIRouter(tags=["Ingest"])
+
+# Seconds clients are told to wait before retrying when the queue is full
+RETRY_AFTER_SECONDS = 30
+
+
+def _enqueue(user_id: str, filename: str, content_type: str, content: bytes) -> str:
+    queue = get_queue()
+    spool_key = spool_upload(content)
+    try:
+        return queue.enqueue(user_id, {
+            "spool_key": spool_key,
+            "filename": filename,
+            "content_type": content_type,
+        })
+    except QueueFull:
+        os.remove(spool_path(spool_key))
+        raise
+
+
+@router.post("/ingest", status_code=202)
+async def ingest_receipt(user_id: str = Query(..., description="User ID from OAuth"), file: UploadFile = File(...)):
+    """
+    Queues a receipt image for the ingest workers (`python -m services.ingest_worker`)
+    and returns at once. Progress is pushed over /ws and can be polled at
+    /ingest/{job_id}. Answers 429 while the queue is at INGEST_MAX_QUEUE_DEPTH.
+    """
+    content = await file.read()
+    # Sanitize filename: remove spaces, special chars (keep alphanumeric, dot, dash, underscore)
+    filename = re.sub(r'[^\w.\-]', '_', file.filename)
+    try:
+        job_id = await asyncio.to_thread(_enqueue, user_id, filename, file.content_type, content)
+    except QueueFull as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": str(e)},
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+    return {"job_id": job_id, "status_url": f"/ingest/{job_id}"}
+
+
+@router.get("/ingest-metrics")
+def get_ingest_metrics():
+    """Queue depth per stage and state, dead-letter count and the age of the oldest pending receipt."""
+    return get_queue().metrics()
+
+
+@router.get("/ingest/{job_id}")
+def get_ingest_job(job_id: str, user_id: str = Query(..., description="User ID from OAuth")):
+    job = get_queue().get(job_id)
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    return {
+        "job_id": job_id,
+        "stage": job["stage"],
+        "state": job["state"],
+        "attempts": job["attempts"],
+        "receipt_id": job["payload"].get("receipt_id"),
+        "last_error": job["last_error"],
+    }
+
+
+@router.post("/ingest/{job_id}/redrive")
+def redrive_ingest_job(job_id: str, user_id: str = Query(..., description="User ID from OAuth")):
+    """Retries a dead-lettered job from the stage it failed in."""
+    queue = get_queue()
+    job = queue.get(job_id)
+    if job is None or job["user_id"] != user_id or not queue.redrive(job_id):
+        raise HTTPException(status_code=404, detail="No dead-lettered ingest job with that ID")
+    return {"success": True, "job_id": job_id}
@@ -0,0 +1,61 @@
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+
+from services.receipts import get_receipt
+from services.default import parse_structured_output
+from services.similarity import claim_index_rebuild, find_similar, index_is_current, index_receipt, rebuild_user_index
+
+router = APIRouter(tags=["Similar Purchases"])
+
+
+@router.get("/receipts/{receipt_id}/similar")
+def get_similar_purchases(
+    background_tasks: BackgroundTasks,
+    receipt_id: str,
+    user_id: str = Query(..., description="User ID from OAuth"),
+    limit: int = Query(10, ge=1, le=50, description="Maximum number of matches"),
+):
+    """
+    Answers the detect_similar_purchases smart action from the per-user similarity
+    index, with price changes for items bought before. No model call is made.
+    index_complete is false while the user's index is being rebuilt in the background;
+    matches then come from the receipts indexed so far.
+    """
+    receipt_doc = get_receipt(receipt_id, user_id)
+    if receipt_doc is None:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+
+    receipt_data = receipt_doc.to_dict()
+    if receipt_data.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+
+    receipt = parse_structured_output(receipt_data.get("structured_output"))
+    if not receipt:
+        raise HTTPException(status_code=400, detail="Receipt has no structured_output yet")
+
+    # Users indexed under an older layout (or never) are rebuilt after the response;
+    # this lookup answers from the index as it is
+    index_complete = index_is_current(user_id)
+    if not index_complete and claim_index_rebuild(user_id):
+        background_tasks.add_task(rebuild_user_index, user_id)
+    if "similarity_terms" not in receipt_data:
+        index_receipt(user_id, receipt_id, receipt_data)
+
+    return {
+        "receipt_id": receipt_id,
+        "shop_name": receipt.get("shop_name"),
+        "index_complete": index_complete,
+        "matches": find_similar(user_id, receipt_id, receipt, limit),
+    }
+
+
+@router.post("/similarity-index/rebuild")
+def rebuild_similarity_index(user_id: str = Query(..., description="User ID from OAuth")):
+    """Re-indexes all of a user's receipts, e.g. for receipts stored before indexing was added."""
+    if not claim_index_rebuild(user_id, force=True):
+        raise HTTPException(status_code=409, detail="A similarity index rebuild is already running for this user")
+    try:
+        indexed = rebuild_user_index(user_id)
+        return {"success": True, "indexed_receipts": indexed}
+    except Exception as e:
+        print(f"Error rebuilding similarity index: {e}")
+        raise HTTPException(status_code=500, detail=f"Error rebuilding similarity index: {str(e)}")
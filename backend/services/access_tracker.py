@@ -0,0 +1,53 @@
+import asyncio
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from services.receipts import receipt_writer, update_receipt
+
+# Seconds between flushes of buffered receipt access times
+FLUSH_INTERVAL_SECONDS = int(os.getenv("ACCESS_FLUSH_INTERVAL_SECONDS", "30"))
+
+
+class AccessTracker:
+    """
+    Write-behind buffer for receipt access times. Reads record an access in memory;
+    repeated accesses to the same receipt between flushes merge into one entry, and
+    flush() writes them all as last_accessed_at through a single BulkWriter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def record(self, doc_id: str, user_id: Optional[str] = None):
+        with self._lock:
+            self._pending[(doc_id, user_id)] = datetime.now(timezone.utc)
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        writer = receipt_writer()
+        for (doc_id, user_id), accessed_at in pending.items():
+            update_receipt(doc_id, user_id, {"last_accessed_at": accessed_at}, writer=writer)
+        writer.close()
+        return len(pending)
+
+    async def run(self, interval: int = FLUSH_INTERVAL_SECONDS):
+        """Flushes every `interval` seconds until cancelled, then flushes once more."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as e:
+                    print(f"Access time flush failed: {e}")
+        finally:
+            await asyncio.to_thread(self.flush)
+
+
+receipt_access = AccessTracker()
@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import google.generativeai as genai
+from google.generativeai import caching
+from firebase_admin import firestore
+
+from init import get_db
+from services.default import parse_structured_output
+from services.receipts import stream_user_receipts
+
+# Context caching needs an explicitly versioned model
+CHAT_MODEL = os.getenv("CHAT_MODEL", "models/gemini-1.5-flash-002")
+CONTEXT_CACHE_TTL = timedelta(minutes=int(os.getenv("CHAT_CONTEXT_CACHE_TTL_MINUTES", "60")))
+MAX_LOCAL_SESSIONS = 256
+MAX_HISTORY_TURNS = 20
+
+SYSTEM_INSTRUCTION = """
+You are Luffy, an intelligent assistant helping users manage their receipts and spending.
+You have access to the user's structured receipt data (in JSON format) below.
+
+Instructions:
+- Analyze the receipts thoroughly before answering.
+- Refer only to facts present in the receipts unless clarification is requested.
+- Provide detailed, step-by-step explanations or summaries if necessary.
+- If there are calculations involved (e.g., spending analysis), show them clearly.
+- If multiple receipts are involved, group or compare them as needed.
+- Your response should be informative, friendly, and accurate.
+
+Respond clearly and concisely.
+"""
+
+_configured = False
+_lock = threading.Lock()
+# session_id -> {"version": int, "context": str, "cached_content": CachedContent | None,
+#                "history": [...], "turn_count": int}
+_sessions = OrderedDict()
+
+
+def _configure():
+    global _configured
+    if not _configured:
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        _configured = True
+
+
+def get_receipts_version(user_id: str) -> int:
+    user_doc = get_db().collection("users").document(user_id).get()
+    return (user_doc.to_dict() or {}).get("receipts_version", 0) if user_doc.exists else 0
+
+
+def build_receipt_context(user_id: str) -> str:
+    receipts = []
+    for _, data in stream_user_receipts(user_id):
+        parsed = parse_structured_output(data.get("structured_output"))
+        if parsed:
+            receipts.append(parsed)
+    return "Receipts:\n" + json.dumps(receipts, indent=2, default=str)
+
+
+def _create_context_cache(session_id: str, context: str):
+    """Creates a Gemini context cache for the receipt context, or None if caching is unavailable."""
+    try:
+        return caching.CachedContent.create(
+            model=CHAT_MODEL,
+            display_name=f"chat-session-{session_id}",
+            system_instruction=SYSTEM_INSTRUCTION,
+            contents=[{"role": "user", "parts": [context]}],
+            ttl=CONTEXT_CACHE_TTL,
+        )
+    except Exception as e:
+        # Below the model's minimum cacheable size, or caching not enabled for the key
+        print(f"Context caching unavailable for session {session_id}: {e}")
+        return None
+
+
+def _is_live(cached) -> bool:
+    # Leave a minute of margin so the cache does not expire mid-request
+    return cached.expire_time is None or cached.expire_time > datetime.now(timezone.utc) + timedelta(minutes=1)
+
+
+def _load_cached_content(name: Optional[str]):
+    if not name:
+        return None
+    try:
+        cached = caching.CachedContent.get(name)
+        return cached if _is_live(cached) else None
+    except Exception:
+        return None
+
+
+def _drop_cached_content(cached):
+    try:
+        cached.delete()
+    except Exception as e:
+        print(f"Could not delete context cache {cached.name}: {e}")
+
+
+def _remember(session_id: str, entry: dict):
+    with _lock:
+        _sessions[session_id] = entry
+        _sessions.move_to_end(session_id)
+        while len(_sessions) > MAX_LOCAL_SESSIONS:
+            _sessions.popitem(last=False)
+
+
+def _load_history(session_ref) -> List[dict]:
+    turns = (
+        session_ref.collection("turns")
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+        .limit(MAX_HISTORY_TURNS)
+        .stream()
+    )
+    history = [{"role": t.get("role"), "parts": [t.get("text")]} for t in (doc.to_dict() for doc in turns)]
+    history.reverse()
+    return history
+
+
+def _session_context(session_id: str, session_ref, session_data: dict) -> dict:
+    """
+    Returns the session's receipt context, rebuilding it only when the user's
+    receipts_version moved since it was built. The local history is reloaded from
+    Firestore when the session's turn_count shows another instance answered a turn.
+    """
+    user_id = session_data["user_id"]
+    version = get_receipts_version(user_id)
+    turn_count = session_data.get("turn_count", 0)
+
+    with _lock:
+        entry = _sessions.get(session_id)
+    if entry and entry["turn_count"] != turn_count:
+        entry["history"] = _load_history(session_ref)
+        entry["turn_count"] = turn_count
+    if entry and entry["version"] == version:
+        if entry["cached_content"] is None or _is_live(entry["cached_content"]):
+            return entry
+        session_data = {**session_data, "context_version": None}
+    elif entry and entry["cached_content"] is not None:
+        _drop_cached_content(entry["cached_content"])
+
+    history = entry["history"] if entry else _load_history(session_ref)
+
+    # Another instance may already have cached this version of the context
+    if session_data.get("context_version") == version:
+        cached = _load_cached_content(session_data.get("cached_content_name"))
+        if cached is not None:
+            entry = {"version": version, "context": None, "cached_content": cached, "history": history, "turn_count": turn_count}
+            _remember(session_id, entry)
+            return entry
+
+    context = build_receipt_context(user_id)
+    cached = _create_context_cache(session_id, context)
+    session_ref.update({
+        "context_version": version,
+        "cached_content_name": cached.name if cached is not None else None,
+        "context_built_at": firestore.SERVER_TIMESTAMP,
+    })
+    entry = {"version": version, "context": context, "cached_content": cached, "history": history, "turn_count": turn_count}
+    _remember(session_id, entry)
+    return entry
+
+
+def create_session(user_id: str) -> str:
+    session_id = str(uuid.uuid4())
+    get_db().collection("chat_sessions").document(session_id).set({
+        "session_id": session_id,
+        "user_id": user_id,
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+        "turn_count": 0,
+    })
+    return session_id
+
+
+def get_session(session_id: str, user_id: str):
+    """Returns (session_ref, session_data), or (None, None) if the session is not the user's."""
+    session_ref = get_db().collection("chat_sessions").document(session_id)
+    session_doc = session_ref.get()
+    if not session_doc.exists or session_doc.to_dict().get("user_id") != user_id:
+        return None, None
+    return session_ref, session_doc.to_dict()
+
+
+def send_message(session_id: str, session_ref, session_data: dict, prompt: str) -> dict:
+    _configure()
+    entry = _session_context(session_id, session_ref, session_data)
+    contents = entry["history"] + [{"role": "user", "parts": [prompt]}]
+
+    if entry["cached_content"] is not None:
+        model = genai.GenerativeModel.from_cached_content(cached_content=entry["cached_content"])
+    else:
+        model = genai.GenerativeModel(CHAT_MODEL, system_instruction=SYSTEM_INSTRUCTION + "\n" + entry["context"])
+
+    response = model.generate_content(contents)
+    reply = response.text
+
+    turns_ref = session_ref.collection("turns")
+    asked_at = datetime.now(timezone.utc)
+    batch = get_db().batch()
+    batch.set(turns_ref.document(), {"role": "user", "text": prompt, "created_at": asked_at})
+    # Strictly later than the user turn so history ordering is stable
+    batch.set(turns_ref.document(), {"role": "model", "text": reply, "created_at": asked_at + timedelta(milliseconds=1)})
+    batch.update(session_ref, {"updated_at": firestore.SERVER_TIMESTAMP, "turn_count": firestore.Increment(1)})
+    batch.commit()
+
+    history = contents + [{"role": "model", "parts": [reply]}]
+    entry["history"] = history[-MAX_HISTORY_TURNS:]
+    entry["turn_count"] = session_data.get("turn_count", 0) + 1
+
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "response": reply,
+        "context_cached": entry["cached_content"] is not None,
+        "usage": {
+            "prompt_tokens": getattr(usage, "prompt_token_count", None),
+            "cached_tokens": getattr(usage, "cached_content_token_count", None),
+            "response_tokens": getattr(usage, "candidates_token_count", None),
+        },
+    }
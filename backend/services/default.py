@@ -1,10 +1,17 @@
-from datetime import datetime
-from init import db
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from init import get_db
+from services.receipts import copy_to_shard
+from firebase_admin import firestore
 from fastapi import Query
 from fastapi.responses import JSONResponse
 from google.cloud.firestore_v1.base_query import FieldFilter
+import json
+import re
 import time
 
+RECEIPT_DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%m/%d/%Y", "%d.%m.%Y", "%d %b %Y", "%d %B %Y", "%b %d, %Y"]
+
 def parse_date(date_str: str) -> datetime:
     """Parse date string in various formats"""
     try:
@@ -17,12 +24,74 @@ def parse_date(date_str: str) -> datetime:
         except:
             # If all else fails, return current time
             return datetime.utcnow()
-        
+
+def parse_receipt_date(value) -> Optional[datetime]:
+    """Parse the free-form date Gemini puts on a receipt, or None if it cannot be read"""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for fmt in RECEIPT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+def compute_expires_at(user_preferences: Optional[dict], from_time: Optional[datetime] = None) -> Optional[datetime]:
+    """When a receipt expires under the user's receipt_expiry preference, or None to keep it forever"""
+    expiry = (user_preferences or {}).get("receipt_expiry")
+    if not isinstance(expiry, dict) or not expiry.get("enabled"):
+        return None
+    days = expiry.get("days")
+    if not isinstance(days, (int, float)) or days <= 0:
+        return None
+    return (from_time or datetime.now(timezone.utc)) + timedelta(days=days)
+
+def parse_amount(value) -> Optional[float]:
+    """Parse an amount such as 120, "120.50" or "₹1,299.00" into a float"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not value:
+        return None
+    match = re.search(r"-?\d+(?:\.\d+)?", str(value).replace(",", ""))
+    return float(match.group()) if match else None
+
+def parse_structured_output(raw_output) -> Optional[dict]:
+    """Parse a receipt's structured_output string, stripping a ```json fence if present"""
+    if not raw_output:
+        return None
+    if isinstance(raw_output, dict):
+        return raw_output
+    cleaned_output = re.sub(r"^```json\n(.*?)\n```$", r"\1", raw_output.strip(), flags=re.DOTALL)
+    try:
+        return json.loads(cleaned_output)
+    except json.JSONDecodeError:
+        return None
+
+def bump_receipts_version(user_id: str, writer=None):
+    """
+    Increments users/{uid}.receipts_version, which chat sessions compare against to
+    know when their cached receipt context is stale. Pass a batch or BulkWriter to
+    add the write to it instead of committing here.
+    """
+    user_ref = get_db().collection("users").document(user_id)
+    update = {"receipts_version": firestore.Increment(1)}
+    if writer is not None:
+        writer.set(user_ref, update, merge=True)
+    else:
+        user_ref.set(update, merge=True)
+
 def update_extracted_text(user_id: str = Query(..., description="User ID from OAuth"), fileUrl: str = ""):
     try:
 
         # Fetch user info
-        user_doc_ref = db.collection("users").document(user_id)
+        user_doc_ref = get_db().collection("users").document(user_id)
         user_doc = user_doc_ref.get()
 
         if not user_doc.exists:
@@ -35,7 +104,7 @@ def update_extracted_text(user_id: str = Query(..., description="User ID from OA
 
         user_preferences = None
         if preferences_id:
-            preferences_doc = db.collection("user_preferences").document(preferences_id).get()
+            preferences_doc = get_db().collection("user_preferences").document(preferences_id).get()
             if preferences_doc.exists:
                 user_preferences = preferences_doc.to_dict().get("preferences", {})
 
@@ -43,7 +112,7 @@ def update_extracted_text(user_id: str = Query(..., description="User ID from OA
         print(file_gs_url)
 
         # Query extracted_texts by file
-        query = db.collection("extracted_texts").where(filter=FieldFilter("file", "==", file_gs_url))
+        query = get_db().collection("extracted_texts").where(filter=FieldFilter("file", "==", file_gs_url))
         docs = query.get()
 
         if not docs:
@@ -63,10 +132,16 @@ def update_extracted_text(user_id: str = Query(..., description="User ID from OA
             "user_name": user_name,
             "user_email": user_email,
             "user_preferences": user_preferences,
+            # Set once here; receipt reads no longer touch it (see last_accessed_at)
+            "timestamp": firestore.SERVER_TIMESTAMP,
+            # Indexed field the expiry sweeper queries on
+            "expires_at": compute_expires_at(user_preferences),
         }
 
         doc_ref.update(update_fields)
+        copy_to_shard(user_id, doc_id, {**doc_data, **update_fields})
         print(f"✅ Updated receipt {doc_id} with user info and preferences")
+        bump_receipts_version(user_id)
            
 
         return doc_id
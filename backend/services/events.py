@@ -0,0 +1,250 @@
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Set
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from init import get_db
+from services.default import parse_structured_output
+
+EVENTS_COLLECTION = "user_events"
+# Events are only needed until connected clients have seen them; configure a
+# Firestore TTL policy on expire_at to have them removed
+EVENT_TTL = timedelta(days=1)
+CLIENT_QUEUE_SIZE = 100
+# How far back the listeners look for receipts and chat messages still in progress,
+# so results finishing after a client connects are pushed
+LISTEN_LOOKBACK = timedelta(minutes=30)
+# Firestore's limit on the values of an "in" filter
+USERS_PER_LISTENER = 30
+
+RECEIPT_EXTRACTED = "receipt_extracted"
+SMART_ACTIONS_READY = "smart_actions_ready"
+CHAT_REPLY = "chat_reply"
+
+
+def publish_event(user_id: str, event_type: str, payload: dict):
+    """
+    Records an event for a user, for producers that run outside a request (e.g. the
+    ingest workers). Backend processes with a WebSocket open for the user push it to
+    them. Failures are logged, never raised, so a push problem cannot fail the work
+    that produced the event.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        get_db().collection(EVENTS_COLLECTION).add({
+            "user_id": user_id,
+            "type": event_type,
+            # Round-trip through JSON so timestamps and other Firestore types become strings
+            "payload": json.loads(json.dumps(payload, default=str)),
+            "created_at": now,
+            "expire_at": now + EVENT_TTL,
+        })
+    except Exception as e:
+        print(f"Error publishing {event_type} event for {user_id}: {e}")
+
+
+def _message(event_type: str, event_id: str, payload: dict, created_at=None) -> dict:
+    return {
+        "type": event_type,
+        "event_id": event_id,
+        "payload": json.loads(json.dumps(payload, default=str)),
+        "created_at": (created_at or datetime.now(timezone.utc)).isoformat(),
+    }
+
+
+def _receipt_update(doc_id: str, data: dict):
+    """(dedupe key, value, message) when a receipt has structured_output, else None."""
+    raw_output = data.get("structured_output")
+    parsed = parse_structured_output(raw_output)
+    if parsed is None:
+        return None
+    return f"receipt:{doc_id}", raw_output, _message(RECEIPT_EXTRACTED, doc_id, {"receipt_id": doc_id, "data": parsed})
+
+
+def _chat_reply(doc_id: str, data: dict):
+    """(dedupe key, value, message) when a /chat message is COMPLETED, else None."""
+    response = data.get("response")
+    if (data.get("status") or {}).get("state") != "COMPLETED" or not response:
+        return None
+    return f"message:{doc_id}", response, _message(CHAT_REPLY, doc_id, {"message_id": doc_id, "response": response})
+
+
+class _UserGroup:
+    """Up to USERS_PER_LISTENER users watched by one listener per collection."""
+
+    def __init__(self):
+        self.users: Set[str] = set()
+        self.watches: List = []
+
+
+class EventHub:
+    """
+    Fans events out to the WebSocket clients connected to this process. The process
+    shares one Firestore listener per watched collection, narrowed with an "in"
+    filter to the users connected here (one more set per USERS_PER_LISTENER users),
+    and dispatches each change by user_id to that user's bounded client queues:
+      extracted_texts  receipt_extracted when a receipt's structured_output appears or changes
+      messages         chat_reply when a /chat message reaches status.state COMPLETED
+      user_events      events published by producers outside a request
+
+    connect() and disconnect() open and close listeners, so call them off the event loop.
+    """
+
+    def __init__(self):
+        # Guards clients and dedupe state; taken by listener threads, never held
+        # while listeners are opened or closed
+        self._lock = threading.Lock()
+        # Serializes listener changes
+        self._watch_lock = threading.Lock()
+        self._clients: Dict[str, Set[asyncio.Queue]] = {}
+        self._connected_at: Dict[str, datetime] = {}
+        # user_id -> {dedupe key: last pushed value}
+        self._seen: Dict[str, dict] = {}
+        self._groups: List[_UserGroup] = []
+        self._loop = None
+
+    def _push(self, user_id: str, message: dict):
+        # Called with self._lock held
+        for queue in self._clients.get(user_id, ()):
+            self._loop.call_soon_threadsafe(self._deliver, queue, message)
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, message: dict):
+        # A client that stopped reading loses its oldest events rather than growing memory
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    def _on_updates(self, extract, established: frozenset):
+        """
+        Listener callback for receipts and chat messages. Changes are pushed when their
+        value differs from the last one pushed. The first snapshot of a listener is
+        existing state: it is only pushed for users the previous listener already
+        watched, to cover changes made while the listener was being replaced.
+        """
+        first = [True]
+
+        def on_snapshot(docs, changes, read_time):
+            initial, first[0] = first[0], False
+            for change in changes:
+                if change.type.name == "REMOVED":
+                    continue
+                data = change.document.to_dict()
+                user_id = data.get("user_id")
+                update = extract(change.document.id, data)
+                if update is None:
+                    continue
+                key, value, message = update
+                with self._lock:
+                    seen = self._seen.get(user_id)
+                    if seen is None or seen.get(key) == value:
+                        continue
+                    seen[key] = value
+                    if not initial or user_id in established:
+                        self._push(user_id, message)
+
+        return on_snapshot
+
+    def _on_events(self, docs, changes, read_time):
+        for change in changes:
+            if change.type.name != "ADDED":
+                continue
+            event = change.document.to_dict()
+            user_id, created_at = event.get("user_id"), event.get("created_at")
+            key = f"event:{change.document.id}"
+            with self._lock:
+                seen = self._seen.get(user_id)
+                # Events from before the user connected were for earlier connections
+                if seen is None or key in seen or (created_at and created_at < self._connected_at[user_id]):
+                    continue
+                seen[key] = True
+                self._push(user_id, _message(event.get("type"), change.document.id, event.get("payload", {}), created_at))
+
+    def _open_watches(self, users: Set[str], established: frozenset) -> list:
+        db = get_db()
+        since = datetime.now(timezone.utc) - LISTEN_LOOKBACK
+        in_users = FieldFilter("user_id", "in", sorted(users))
+        return [
+            db.collection("extracted_texts").where(filter=in_users)
+            .where(filter=FieldFilter("timestamp", ">=", since))
+            .on_snapshot(self._on_updates(_receipt_update, established)),
+            db.collection("messages").where(filter=in_users)
+            .where(filter=FieldFilter("created_at", ">=", since))
+            .on_snapshot(self._on_updates(_chat_reply, established)),
+            db.collection(EVENTS_COLLECTION).where(filter=in_users)
+            .where(filter=FieldFilter("created_at", ">=", since))
+            .on_snapshot(self._on_events),
+        ]
+
+    @staticmethod
+    def _close_watches(watches: list):
+        for watch in watches:
+            watch.unsubscribe()
+
+    def connect(self, user_id: str, queue: asyncio.Queue, loop: asyncio.AbstractEventLoop):
+        """Registers a client queue, adding the user to a listener group if not yet watched."""
+        with self._lock:
+            self._loop = loop
+            self._clients.setdefault(user_id, set()).add(queue)
+            if user_id not in self._seen:
+                self._seen[user_id] = {}
+                self._connected_at[user_id] = datetime.now(timezone.utc)
+
+        with self._watch_lock:
+            if any(user_id in group.users for group in self._groups):
+                return
+            with self._lock:
+                # Users that disconnected since a group was opened free up its places
+                for group in self._groups:
+                    group.users &= set(self._clients)
+            group = next((g for g in self._groups if len(g.users) < USERS_PER_LISTENER), None)
+            if group is None:
+                group = _UserGroup()
+                self._groups.append(group)
+            established = frozenset(group.users)
+            group.users.add(user_id)
+            # Open the replacement before closing the old listeners so no change is
+            # missed in between; duplicates are dropped by the dedupe state
+            old_watches, group.watches = group.watches, self._open_watches(group.users, established)
+            self._close_watches(old_watches)
+
+    def disconnect(self, user_id: str, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._clients.get(user_id)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if queues:
+                return
+            del self._clients[user_id]
+            del self._seen[user_id]
+            del self._connected_at[user_id]
+
+        # A group keeps its listeners until another user joins it, unless nobody in
+        # it is connected any more
+        with self._watch_lock:
+            with self._lock:
+                connected = set(self._clients)
+            for group in [g for g in self._groups if not g.users & connected]:
+                self._groups.remove(group)
+                self._close_watches(group.watches)
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return sum(len(queues) for queues in self._clients.values())
+
+    def listener_count(self) -> int:
+        with self._watch_lock:
+            return sum(len(group.watches) for group in self._groups)
+
+    def close(self):
+        with self._watch_lock:
+            groups, self._groups = self._groups, []
+            for group in groups:
+                self._close_watches(group.watches)
+
+
+hub = EventHub()
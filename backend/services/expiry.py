@@ -0,0 +1,189 @@
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+from init import get_bucket, get_db
+from services.default import bump_receipts_version, compute_expires_at
+from services.receipts import all_receipt_refs, expired_receipts_query, receipt_writer, stream_all_receipts, update_receipt
+from services.similarity import unindex_receipt
+
+CHECKPOINT_DOC = ("maintenance", "receipt_expiry_sweeper")
+BATCH_SIZE = 200
+MAX_BATCHES_PER_RUN = 50
+BLOB_DELETE_WORKERS = 16
+# Only one sweeper runs at a time across instances; the lease is renewed after every
+# batch, so it only has to outlive a single batch
+LEASE_DURATION = timedelta(minutes=5)
+
+
+def _checkpoint_ref():
+    collection, document = CHECKPOINT_DOC
+    return get_db().collection(collection).document(document)
+
+
+@firestore.transactional
+def _take_lease(transaction, checkpoint_ref, owner: str) -> bool:
+    """Takes or renews the sweeper lease on the checkpoint document; False if another run holds it."""
+    now = datetime.now(timezone.utc)
+    snapshot = checkpoint_ref.get(transaction=transaction)
+    lease = (snapshot.to_dict() or {}).get("lease") if snapshot.exists else None
+    if lease and lease.get("owner") != owner and lease.get("expires_at") and lease["expires_at"] > now:
+        return False
+    transaction.set(checkpoint_ref, {"lease": {"owner": owner, "expires_at": now + LEASE_DURATION}}, merge=True)
+    return True
+
+
+@firestore.transactional
+def _release_lease(transaction, checkpoint_ref, owner: str):
+    snapshot = checkpoint_ref.get(transaction=transaction)
+    lease = (snapshot.to_dict() or {}).get("lease") if snapshot.exists else None
+    if lease and lease.get("owner") == owner:
+        transaction.update(checkpoint_ref, {"lease": firestore.DELETE_FIELD})
+
+
+def _blob_path(file_url: Optional[str]) -> Optional[str]:
+    """gs://bucket/receipts/x.jpg -> receipts/x.jpg"""
+    if not file_url or not file_url.startswith("gs://"):
+        return None
+    parts = file_url[len("gs://"):].split("/", 1)
+    return parts[1] if len(parts) == 2 else None
+
+
+def _delete_blob(path: str) -> int:
+    """Deletes one blob and returns the bytes it held (0 if it was already gone)."""
+    try:
+        blob = get_bucket().get_blob(path)
+        if blob is None:
+            return 0
+        size = blob.size or 0
+        blob.delete()
+        return size
+    except NotFound:
+        return 0
+
+
+def _delete_batch(entries: list, executor: ThreadPoolExecutor) -> dict:
+    """
+    Deletes the blobs of a batch concurrently and the documents through a BulkWriter,
+    dropping each receipt from its owner's similarity index on the way.
+    """
+    blob_paths = [entry["blob"] for entry in entries if entry.get("blob")]
+    reclaimed_bytes = sum(executor.map(_delete_blob, blob_paths))
+
+    db = get_db()
+    writer = db.bulk_writer()
+    for entry in entries:
+        if entry.get("user_id") and entry.get("terms"):
+            unindex_receipt(entry["user_id"], entry["id"], entry["terms"], batch=writer)
+        for ref in all_receipt_refs(entry["id"], entry.get("user_id")):
+            writer.delete(ref)
+    for user_id in {entry["user_id"] for entry in entries if entry.get("user_id")}:
+        bump_receipts_version(user_id, writer)
+    writer.close()
+
+    return {"documents": len(entries), "blobs": len(blob_paths), "bytes": reclaimed_bytes}
+
+
+def sweep_expired_receipts(max_batches: int = MAX_BATCHES_PER_RUN, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Deletes receipts whose expires_at has passed, in bounded batches.
+
+    Before a batch is deleted its ids and blob paths are written to the checkpoint
+    document, and cleared once the batch is done, so a run that crashes mid-batch
+    finishes that batch on the next start instead of leaving orphaned blobs.
+
+    Runs hold a lease on the checkpoint document, so when several instances sweep on
+    the same schedule only one of them works on the checkpoint; the others skip.
+    """
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    checkpoint_ref = _checkpoint_ref()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    if not _take_lease(get_db().transaction(), checkpoint_ref, owner):
+        print("Expiry sweep skipped: another instance holds the sweeper lease")
+        return {"skipped": True}
+
+    try:
+        return _sweep(checkpoint_ref, owner, now, started, max_batches, batch_size)
+    finally:
+        _release_lease(get_db().transaction(), checkpoint_ref, owner)
+
+
+def _sweep(checkpoint_ref, owner: str, now: datetime, started: float, max_batches: int, batch_size: int) -> dict:
+    checkpoint = checkpoint_ref.get()
+    checkpoint = checkpoint.to_dict() if checkpoint.exists else {}
+    totals = checkpoint.get("totals", {"documents": 0, "blobs": 0, "bytes": 0})
+    run = {"documents": 0, "blobs": 0, "bytes": 0, "batches": 0}
+
+    query = expired_receipts_query(now, batch_size)
+
+    with ThreadPoolExecutor(max_workers=BLOB_DELETE_WORKERS) as executor:
+        pending = checkpoint.get("pending") or []
+        if pending:
+            print(f"Resuming interrupted expiry batch of {len(pending)} receipts")
+
+        while run["batches"] < max_batches:
+            if not pending:
+                pending = [{
+                    "id": doc.id,
+                    "blob": _blob_path(data.get("file")),
+                    "user_id": data.get("user_id"),
+                    "terms": data.get("similarity_terms") or [],
+                } for doc, data in ((doc, doc.to_dict()) for doc in query.stream())]
+                if not pending:
+                    break
+                checkpoint_ref.set({"pending": pending}, merge=True)
+
+            deleted = _delete_batch(pending, executor)
+            for key in ("documents", "blobs", "bytes"):
+                run[key] += deleted[key]
+                totals[key] = totals.get(key, 0) + deleted[key]
+            run["batches"] += 1
+            pending = []
+            checkpoint_ref.set({"pending": [], "totals": totals}, merge=True)
+
+            if not _take_lease(get_db().transaction(), checkpoint_ref, owner):
+                print("Expiry sweep stopped: the sweeper lease was taken over")
+                break
+
+    run["duration_seconds"] = round(time.perf_counter() - started, 2)
+    checkpoint_ref.set({"last_run": {**run, "finished_at": firestore.SERVER_TIMESTAMP}}, merge=True)
+    print(f"🧹 Expiry sweep removed {run['documents']} receipts, {run['blobs']} blobs, {run['bytes']} bytes")
+    return {**run, "totals": totals}
+
+
+def backfill_expires_at(page_size: int = BATCH_SIZE) -> int:
+    """
+    One-off pass that sets expires_at on receipts stored before it was computed at
+    ingest, from the user_preferences copied onto each receipt. Returns the number updated.
+    """
+    updated = 0
+    writer = receipt_writer()
+    for receipt_id, data in stream_all_receipts(page_size):
+        if "expires_at" in data:
+            continue
+        created = data.get("timestamp") if isinstance(data.get("timestamp"), datetime) else None
+        expires_at = compute_expires_at(data.get("user_preferences"), created)
+        update_receipt(receipt_id, data.get("user_id"), {"expires_at": expires_at}, writer=writer)
+        updated += 1
+    writer.close()
+    return updated
+
+
+if __name__ == "__main__":
+    # Run from backend/, e.g. from cron or Cloud Scheduler:
+    #   python -m services.expiry            sweep expired receipts
+    #   python -m services.expiry backfill   set expires_at on older receipts
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        print(f"Backfilled expires_at on {backfill_expires_at()} receipts")
+    else:
+        print(sweep_expired_receipts())
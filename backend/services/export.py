@@ -0,0 +1,212 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from services.default import parse_receipt_date, parse_structured_output
+from services.receipts import stream_user_receipts
+
+EXPORT_FORMATS = {
+    "csv": {"media_type": "text/csv", "extension": "csv"},
+    "ndjson": {"media_type": "application/x-ndjson", "extension": "ndjson"},
+    "pdf": {"media_type": "application/pdf", "extension": "pdf"},
+}
+
+CSV_COLUMNS = [
+    "receipt_id", "date", "shop_name", "shop_location", "expense_category",
+    "total_amount", "item_count", "items", "reimbursable_items",
+]
+
+
+def iter_export_receipts(
+    user_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    category: Optional[str] = None,
+) -> Iterator[dict]:
+    """
+    Yields the parsed structured output of each of a user's receipts that matches the
+    filters, with "receipt_id" added. Receipts are pulled page by page from Firestore.
+    """
+    category = category.lower() if category else None
+    for doc_id, data in stream_user_receipts(user_id):
+        receipt = parse_structured_output(data.get("structured_output"))
+        if not receipt:
+            continue
+
+        if category and str(receipt.get("expense_category", "")).lower() != category:
+            continue
+
+        if start_date or end_date:
+            receipt_date = parse_receipt_date(receipt.get("date")) or parse_receipt_date(data.get("timestamp"))
+            if receipt_date is None:
+                continue
+            if start_date and receipt_date < start_date:
+                continue
+            if end_date and receipt_date > end_date:
+                continue
+
+        yield {"receipt_id": doc_id, **receipt}
+
+
+def _item_label(item) -> str:
+    if isinstance(item, dict):
+        name = item.get("name", "Item")
+        amount = item.get("amount")
+        return f"{name}: {amount}" if amount is not None else str(name)
+    return str(item)
+
+
+def to_row(receipt: dict) -> dict:
+    items = receipt.get("items") or []
+    reimbursable = receipt.get("reimbursable_items") or []
+    return {
+        "receipt_id": receipt.get("receipt_id"),
+        "date": receipt.get("date", ""),
+        "shop_name": receipt.get("shop_name", ""),
+        "shop_location": receipt.get("shop_location", ""),
+        "expense_category": receipt.get("expense_category", ""),
+        "total_amount": receipt.get("total_amount", ""),
+        "item_count": len(items),
+        "items": "; ".join(_item_label(item) for item in items),
+        "reimbursable_items": "; ".join(_item_label(item) for item in reimbursable),
+    }
+
+
+def render_csv(receipts: Iterable[dict]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for receipt in receipts:
+        writer.writerow(to_row(receipt))
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+    # Header only, for users without matching receipts
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def render_ndjson(receipts: Iterable[dict]) -> Iterator[bytes]:
+    for receipt in receipts:
+        yield (json.dumps(receipt, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _pdf_text(value) -> str:
+    # Built-in Helvetica only covers Latin-1: spell out the rupee sign, anything else becomes "?"
+    text = str(value).replace("₹", "Rs ")
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+class _PdfWriter:
+    """
+    Minimal streaming PDF writer: every object is emitted as soon as it is complete and
+    only byte offsets are kept, so a report with thousands of pages uses constant memory.
+    Object 1 is the catalog, 2 the page tree (written last, once all pages are known)
+    and 3 the font.
+    """
+
+    PAGE_WIDTH = 595
+    PAGE_HEIGHT = 842
+    MARGIN = 50
+    LINE_HEIGHT = 14
+
+    def __init__(self):
+        self.offsets = {}
+        self.position = 0
+        self.next_id = 4
+        self.page_ids = []
+
+    def _emit(self, data: bytes) -> bytes:
+        self.position += len(data)
+        return data
+
+    def _object(self, obj_id: int, body: bytes) -> bytes:
+        self.offsets[obj_id] = self.position
+        return self._emit(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+
+    def header(self) -> Iterator[bytes]:
+        yield self._emit(b"%PDF-1.4\n")
+        yield self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        yield self._object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    def lines_per_page(self) -> int:
+        return (self.PAGE_HEIGHT - 2 * self.MARGIN) // self.LINE_HEIGHT
+
+    def page(self, lines: list) -> Iterator[bytes]:
+        content = [b"BT /F1 10 Tf %d TL %d %d Td" % (self.LINE_HEIGHT, self.MARGIN, self.PAGE_HEIGHT - self.MARGIN)]
+        for line in lines:
+            content.append(b"(" + _pdf_text(line).encode("latin-1") + b") Tj T*")
+        content.append(b"ET")
+        stream = b"\n".join(content)
+
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+        yield self._object(content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        yield self._object(page_id, (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+        ) % (self.PAGE_WIDTH, self.PAGE_HEIGHT, content_id))
+
+    def trailer(self) -> Iterator[bytes]:
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.page_ids)
+        yield self._object(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(self.page_ids))
+
+        xref_offset = self.position
+        xref = [b"xref\n0 %d\n" % self.next_id, b"0000000000 65535 f \n"]
+        for obj_id in range(1, self.next_id):
+            xref.append(b"%010d 00000 n \n" % self.offsets[obj_id])
+        yield self._emit(b"".join(xref))
+        yield self._emit(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%EOF\n" % (self.next_id, xref_offset))
+
+
+def _receipt_lines(receipt: dict) -> list:
+    row = to_row(receipt)
+    lines = [
+        f"{row['date'] or 'Unknown date'}  |  {row['shop_name'] or 'Unknown shop'}  |  {row['total_amount']}",
+        f"    Category: {row['expense_category'] or 'N/A'}   Receipt: {row['receipt_id']}",
+    ]
+    for item in receipt.get("items") or []:
+        lines.append(f"    - {_item_label(item)}")
+    lines.append("")
+    return lines
+
+
+def render_pdf(receipts: Iterable[dict], title: str = "Receipt Report") -> Iterator[bytes]:
+    writer = _PdfWriter()
+    yield from writer.header()
+
+    per_page = writer.lines_per_page()
+    lines = [title, f"Generated {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC", ""]
+    count = 0
+    for receipt in receipts:
+        count += 1
+        lines.extend(_receipt_lines(receipt))
+        while len(lines) >= per_page:
+            yield from writer.page(lines[:per_page])
+            lines = lines[per_page:]
+
+    lines.append(f"Total receipts: {count}")
+    yield from writer.page(lines)
+    yield from writer.trailer()
+
+
+RENDERERS = {
+    "csv": render_csv,
+    "ndjson": render_ndjson,
+    "pdf": render_pdf,
+}
+
+
+def export_receipts(
+    user_id: str,
+    export_format: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    category: Optional[str] = None,
+) -> Iterator[bytes]:
+    receipts = iter_export_receipts(user_id, start_date, end_date, category)
+    return RENDERERS[export_format](receipts)
@@ -0,0 +1,256 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+# Durable local queue for the receipt pipeline. One row per receipt moves through
+# STAGES; each stage is claimed by a worker under a lease, retried with backoff on
+# failure and dead-lettered after MAX_ATTEMPTS. The API process only enqueues.
+QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "ingest_queue.db")
+SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "ingest_spool")
+
+STAGES = ["store", "wait_extraction", "attach_user", "structure", "smart_actions"]
+DONE = "done"
+
+MAX_QUEUE_DEPTH = int(os.getenv("INGEST_MAX_QUEUE_DEPTH", "1000"))
+MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+LEASE_SECONDS = 300
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    state TEXT NOT NULL,            -- ready | running | done | dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at REAL NOT NULL,
+    lease_until REAL,
+    stage_started_at REAL NOT NULL,
+    payload TEXT NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (stage, state, next_run_at);
+"""
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IngestQueue:
+    def __init__(self, path: str = QUEUE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets the API enqueue while workers claim
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _row(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def depth(self) -> int:
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE state IN ('ready', 'running')"
+        ).fetchone()
+        return row[0]
+
+    def enqueue(self, user_id: str, payload: dict) -> str:
+        """Adds a receipt at the first stage. Raises QueueFull when the backlog is at its limit."""
+        if self.depth() >= MAX_QUEUE_DEPTH:
+            raise QueueFull(f"Ingest queue is full ({MAX_QUEUE_DEPTH} receipts pending)")
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (id, user_id, stage, state, next_run_at, stage_started_at, payload, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'ready', ?, ?, ?, ?, ?)",
+            (job_id, user_id, STAGES[0], now, now, json.dumps(payload), now, now),
+        )
+        return job_id
+
+    def claim(self, stage: str) -> Optional[dict]:
+        """Leases the next runnable job of a stage, or returns None."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE stage = ? AND state = 'ready' AND next_run_at <= ? "
+                "ORDER BY next_run_at LIMIT 1",
+                (stage, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', lease_until = ?, updated_at = ? WHERE id = ?",
+                (now + LEASE_SECONDS, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = self._row(row)
+        # The lease identifies this claim; updates made under an older one are dropped
+        job.update(state="running", lease_until=now + LEASE_SECONDS)
+        return job
+
+    def _update_leased(self, job: dict, assignments: str, params: tuple) -> bool:
+        """
+        Applies an update only while the caller's claim still holds the job. Returns
+        False when the lease expired and the job was requeued or reclaimed since.
+        """
+        cursor = self._connect().execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ? AND state = 'running' AND lease_until = ?",
+            (*params, job["id"], job["lease_until"]),
+        )
+        return cursor.rowcount == 1
+
+    def advance(self, job: dict, payload: dict) -> bool:
+        """Moves a claimed job to its next stage (or done) with the updated payload."""
+        index = STAGES.index(job["stage"])
+        next_stage = STAGES[index + 1] if index + 1 < len(STAGES) else job["stage"]
+        state = "ready" if index + 1 < len(STAGES) else DONE
+        now = time.time()
+        return self._update_leased(
+            job,
+            "stage = ?, state = ?, attempts = 0, next_run_at = ?, lease_until = NULL, "
+            "stage_started_at = ?, payload = ?, last_error = NULL, updated_at = ?",
+            (next_stage, state, now, now, json.dumps(payload), now),
+        )
+
+    def retry_later(self, job: dict, delay: float, error: Optional[str] = None, count_attempt: bool = True) -> bool:
+        attempts = job["attempts"] + (1 if count_attempt else 0)
+        now = time.time()
+        return self._update_leased(
+            job,
+            "state = 'ready', attempts = ?, next_run_at = ?, lease_until = NULL, last_error = ?, updated_at = ?",
+            (attempts, now + delay, error, now),
+        )
+
+    def fail(self, job: dict, error: str) -> bool:
+        """Schedules a retry with exponential backoff, or dead-letters the job after MAX_ATTEMPTS."""
+        attempts = job["attempts"] + 1
+        if attempts >= MAX_ATTEMPTS:
+            return self.dead_letter(job, error)
+        delay = min(BACKOFF_BASE_SECONDS * 2 ** attempts, BACKOFF_MAX_SECONDS)
+        return self.retry_later(job, delay * random.uniform(0.8, 1.2), error)
+
+    def dead_letter(self, job: dict, error: str) -> bool:
+        now = time.time()
+        return self._update_leased(
+            job,
+            "state = 'dead', attempts = attempts + 1, lease_until = NULL, last_error = ?, updated_at = ?",
+            (error, now),
+        )
+
+    def requeue_expired_leases(self) -> Tuple[int, int]:
+        """
+        Returns jobs whose worker died mid-stage to the ready state. The lost run
+        counts as an attempt, so a job that keeps crashing its worker is dead-lettered
+        after MAX_ATTEMPTS. Returns (requeued, dead_lettered).
+        """
+        conn = self._connect()
+        now = time.time()
+        error = "Worker stopped mid-stage (lease expired)"
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            dead = conn.execute(
+                "UPDATE jobs SET state = 'dead', attempts = attempts + 1, lease_until = NULL, last_error = ?, "
+                "updated_at = ? WHERE state = 'running' AND lease_until < ? AND attempts + 1 >= ?",
+                (error, now, now, MAX_ATTEMPTS),
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET state = 'ready', attempts = attempts + 1, next_run_at = ?, lease_until = NULL, "
+                "last_error = ?, updated_at = ? WHERE state = 'running' AND lease_until < ?",
+                (now, error, now, now),
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued, dead
+
+    def redrive(self, job_id: str) -> bool:
+        """Puts a dead-lettered job back at the stage it failed in."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET state = 'ready', attempts = 0, next_run_at = ?, stage_started_at = ?, updated_at = ? "
+            "WHERE id = ? AND state = 'dead'",
+            (now, now, now, job_id),
+        )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def metrics(self) -> dict:
+        conn = self._connect()
+        now = time.time()
+        stages = {stage: {"ready": 0, "running": 0, "dead": 0} for stage in STAGES}
+        for row in conn.execute(
+            "SELECT stage, state, COUNT(*) AS n FROM jobs WHERE state != 'done' GROUP BY stage, state"
+        ):
+            stages[row["stage"]][row["state"]] = row["n"]
+        oldest = conn.execute(
+            "SELECT MIN(created_at) FROM jobs WHERE state IN ('ready', 'running')"
+        ).fetchone()[0]
+        done = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'done'").fetchone()[0]
+        return {
+            "depth": sum(s["ready"] + s["running"] for s in stages.values()),
+            "max_depth": MAX_QUEUE_DEPTH,
+            "dead_letters": sum(s["dead"] for s in stages.values()),
+            "done": done,
+            "oldest_pending_seconds": round(now - oldest, 1) if oldest else 0,
+            "stages": stages,
+        }
+
+
+def spool_path(job_key: str) -> str:
+    return os.path.join(SPOOL_DIR, job_key)
+
+
+def spool_upload(content: bytes) -> str:
+    """Writes an uploaded file to the spool directory and returns its key."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    key = str(uuid.uuid4())
+    tmp_path = spool_path(key) + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, spool_path(key))
+    return key
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> IngestQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = IngestQueue()
+    return _queue
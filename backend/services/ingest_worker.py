@@ -0,0 +1,251 @@
+"""
+Runs the receipt pipeline for jobs enqueued through POST /ingest.
+
+Run from backend/, on the host that shares the API's INGEST_QUEUE_PATH and
+INGEST_SPOOL_DIR:
+
+    python -m services.ingest_worker [--concurrency store=4,structure=2]
+
+Each stage has its own fixed pool of worker threads, so a slow stage (e.g. Gemini
+during a burst) queues work instead of starving the others. Stages:
+
+    store            upload the spooled file to the bucket
+    wait_extraction  poll extracted_texts until the text-extraction trigger has run
+    attach_user      link the receipt to its user and preferences
+    structure        structure the text via process_with_gemini unless already done
+    smart_actions    generate smart actions for the user's enabled preferences
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import threading
+import time
+
+from fastapi.responses import JSONResponse
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from init import get_bucket, get_db
+from services.default import bump_receipts_version, parse_structured_output, update_extracted_text
+from services.events import RECEIPT_EXTRACTED, SMART_ACTIONS_READY, publish_event
+from services.ingest_queue import STAGES, get_queue, spool_path
+from services.receipts import FLAT_COLLECTION, get_receipt, reads_flat, update_receipt
+from services.similarity import index_receipt
+
+# Worker threads per stage; override with INGEST_CONCURRENCY="store=4,structure=2"
+DEFAULT_CONCURRENCY = {
+    "store": 4,
+    "wait_extraction": 4,
+    "attach_user": 4,
+    "structure": 2,
+    "smart_actions": 2,
+}
+
+POLL_INTERVAL_SECONDS = 1.0
+EXTRACTION_POLL_SECONDS = 3
+# How long to wait for the text-extraction trigger before dead-lettering a receipt
+EXTRACTION_TIMEOUT_SECONDS = int(os.getenv("INGEST_EXTRACTION_TIMEOUT_SECONDS", "600"))
+LEASE_REAP_INTERVAL_SECONDS = 30
+
+
+class NotReady(Exception):
+    """The stage's input does not exist yet; retried without counting as a failure."""
+
+
+class PermanentError(Exception):
+    """Retrying cannot help (e.g. unknown user); the job is dead-lettered at once."""
+
+
+def store(job: dict, payload: dict) -> dict:
+    path = spool_path(payload["spool_key"])
+    # Named after the job so a retry overwrites the same blob instead of adding one
+    blob = get_bucket().blob(f"receipts/{job['id']}_{payload['filename']}")
+    blob.upload_from_filename(path, content_type=payload.get("content_type"))
+    blob.make_public()
+    return {**payload, "file_url": blob.public_url}
+
+
+def wait_extraction(job: dict, payload: dict) -> dict:
+    file_gs_url = payload["file_url"].replace("https://storage.googleapis.com/", "gs://")
+    docs = (
+        get_db().collection(FLAT_COLLECTION)
+        .where(filter=FieldFilter("file", "==", file_gs_url))
+        .limit(1)
+        .get()
+    )
+    if not docs:
+        raise NotReady(f"No extracted text yet for {file_gs_url}")
+    return {**payload, "receipt_id": docs[0].id}
+
+
+def attach_user(job: dict, payload: dict) -> dict:
+    result = update_extracted_text(job["user_id"], payload["file_url"])
+    if isinstance(result, JSONResponse):
+        error = json.loads(result.body).get("error")
+        if result.status_code == 404:
+            raise PermanentError(error)
+        raise RuntimeError(error)
+    return payload
+
+
+def structure(job: dict, payload: dict) -> dict:
+    # Deferred so the API process, which never structures, does not load the parser
+    from gemini_processor import enrich_in_background, needs_enrichment, process_with_gemini
+
+    user_id, receipt_id = job["user_id"], payload["receipt_id"]
+    receipt_doc = get_receipt(receipt_id, user_id)
+    if receipt_doc is None:
+        raise RuntimeError(f"Receipt {receipt_id} disappeared")
+    receipt_data = receipt_doc.to_dict()
+
+    structured = parse_structured_output(receipt_data.get("structured_output"))
+    if structured is None:
+        text = receipt_data.get("text")
+        if not text:
+            raise PermanentError("Extracted text is empty")
+
+        def save(result: dict):
+            update_receipt(receipt_id, user_id, {"structured_output": json.dumps(result)})
+            bump_receipts_version(user_id)
+            # /ws listens on extracted_texts, which sharded mode no longer writes
+            if not reads_flat():
+                publish_event(user_id, RECEIPT_EXTRACTED, {"receipt_id": receipt_id, "data": result})
+
+        structured = process_with_gemini(text)
+        # A low-confidence local parse comes back with enrichment_error when the inline
+        # Gemini call failed; retry rather than store it as the receipt's result
+        error = structured.get("error") or structured.get("enrichment_error")
+        if error:
+            raise RuntimeError(f"Structuring failed: {error}")
+        save(structured)
+        receipt_data["structured_output"] = json.dumps(structured)
+        # Only now, so a fast enrichment cannot be overwritten by the provisional result
+        if needs_enrichment(structured):
+            enrich_in_background(text, structured, save)
+
+    try:
+        index_receipt(user_id, receipt_id, receipt_data)
+    except Exception as e:
+        print(f"Error indexing receipt {receipt_id}: {e}")
+    return payload
+
+
+def smart_actions(job: dict, payload: dict) -> dict:
+    from routes.geminiADK import convert_firestore_data, generate_smart_actions_with_gemini
+
+    user_id, receipt_id = job["user_id"], payload["receipt_id"]
+    receipt_data = convert_firestore_data(get_receipt(receipt_id, user_id).to_dict())
+    structured = parse_structured_output(receipt_data.get("structured_output"))
+    user_preferences = receipt_data.get("user_preferences") or {}
+    if not structured or not user_preferences:
+        return payload
+
+    actions = asyncio.run(generate_smart_actions_with_gemini(structured, user_preferences))
+    update_receipt(receipt_id, user_id, {"smart_actions": actions})
+    publish_event(user_id, SMART_ACTIONS_READY, {"receipt_id": receipt_id, "smartactions": actions})
+    return payload
+
+
+HANDLERS = {
+    "store": store,
+    "wait_extraction": wait_extraction,
+    "attach_user": attach_user,
+    "structure": structure,
+    "smart_actions": smart_actions,
+}
+
+
+def run_job(job: dict):
+    queue = get_queue()
+    stage = job["stage"]
+    try:
+        payload = HANDLERS[stage](job, job["payload"])
+    except NotReady as e:
+        if time.time() - job["stage_started_at"] > EXTRACTION_TIMEOUT_SECONDS:
+            recorded = queue.dead_letter(job, f"Timed out: {e}")
+        else:
+            recorded = queue.retry_later(job, EXTRACTION_POLL_SECONDS, str(e), count_attempt=False)
+    except PermanentError as e:
+        print(f"Ingest job {job['id']} failed permanently at {stage}: {e}")
+        recorded = queue.dead_letter(job, str(e))
+    except Exception as e:
+        print(f"Ingest job {job['id']} failed at {stage} (attempt {job['attempts'] + 1}): {e}")
+        recorded = queue.fail(job, str(e))
+    else:
+        recorded = queue.advance(job, payload)
+        # Kept when the lease was lost: the worker that reclaimed the job uploads it again
+        if recorded and stage == "store":
+            try:
+                os.remove(spool_path(payload["spool_key"]))
+            except FileNotFoundError:
+                pass
+
+    if not recorded:
+        print(f"Ingest job {job['id']} lost its lease during {stage}; result dropped")
+
+
+def stage_worker(stage: str, stop: threading.Event):
+    queue = get_queue()
+    while not stop.is_set():
+        try:
+            job = queue.claim(stage)
+        except Exception as e:
+            print(f"Claiming a {stage} job failed: {e}")
+            job = None
+        if job is None:
+            stop.wait(POLL_INTERVAL_SECONDS)
+            continue
+        run_job(job)
+
+
+def lease_reaper(stop: threading.Event):
+    queue = get_queue()
+    while not stop.wait(LEASE_REAP_INTERVAL_SECONDS):
+        requeued, dead = queue.requeue_expired_leases()
+        if requeued or dead:
+            print(f"Requeued {requeued} and dead-lettered {dead} ingest jobs whose worker stopped mid-stage")
+
+
+def parse_concurrency(spec: str) -> dict:
+    concurrency = dict(DEFAULT_CONCURRENCY)
+    for part in filter(None, re.split(r"\s*,\s*", spec or "")):
+        stage, _, count = part.partition("=")
+        if stage not in STAGES:
+            raise ValueError(f"Unknown ingest stage: {stage}")
+        concurrency[stage] = int(count)
+    return concurrency
+
+
+def run_workers(concurrency: dict):
+    """Starts every stage's threads and blocks until SIGINT or SIGTERM; running jobs finish first."""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    # Jobs a previous worker process left running go back to ready once their lease runs out
+    get_queue().requeue_expired_leases()
+    threads = [threading.Thread(target=lease_reaper, args=(stop,), daemon=True)]
+    for stage, count in concurrency.items():
+        threads += [threading.Thread(target=stage_worker, args=(stage, stop), name=f"{stage}-{i}") for i in range(count)]
+    for thread in threads:
+        thread.start()
+
+    print(f"Ingest workers running: {concurrency}")
+    while not stop.is_set():
+        stop.wait(1)
+    print("Stopping ingest workers...")
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the receipt ingest worker pool")
+    parser.add_argument(
+        "--concurrency",
+        default=os.getenv("INGEST_CONCURRENCY", ""),
+        help="Per-stage thread counts, e.g. store=4,structure=2",
+    )
+    args = parser.parse_args()
+    run_workers(parse_concurrency(args.concurrency))
@@ -0,0 +1,111 @@
+"""
+Copies receipts from the flat extracted_texts collection into users/{uid}/receipts.
+
+Run from backend/ while RECEIPT_STORAGE_MODE=dual, which keeps reading extracted_texts:
+
+    python -m services.migrate_receipts [--rate 200] [--page-size 300] [--delete-source] [--restart]
+
+Progress is checkpointed in maintenance/receipt_shard_migration after every page, so an
+interrupted run continues where it stopped. Receipts not yet linked to a user are
+skipped; they are copied at ingest once linked. Run with --restart before switching
+to sharded, to refresh copies the extraction trigger has updated since.
+
+--delete-source is only accepted in sharded mode: dual mode's expiry sweep and
+/debug-all read extracted_texts, so receipts without a flat copy would never expire.
+"""
+import argparse
+import time
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+
+from init import get_db
+from services.receipts import FLAT_COLLECTION, RECEIPT_STORAGE_MODE, copy_to_shard, flat_ref, reads_sharded
+
+CHECKPOINT_DOC = ("maintenance", "receipt_shard_migration")
+
+
+def _checkpoint_ref():
+    collection, document = CHECKPOINT_DOC
+    return get_db().collection(collection).document(document)
+
+
+def migrate_receipts(rate: int = 200, page_size: int = 300, delete_source: bool = False, restart: bool = False) -> dict:
+    """
+    Copies every linked receipt into its owner's subcollection with a BulkWriter capped
+    at `rate` writes per second. With delete_source the flat copy is removed once the
+    page it belongs to has been written, which requires sharded mode.
+    """
+    if not reads_sharded():
+        raise RuntimeError("Set RECEIPT_STORAGE_MODE to dual (or sharded) before migrating")
+    if delete_source and RECEIPT_STORAGE_MODE != "sharded":
+        raise RuntimeError("--delete-source needs RECEIPT_STORAGE_MODE=sharded; dual mode still reads extracted_texts")
+
+    db = get_db()
+    checkpoint_ref = _checkpoint_ref()
+    checkpoint = {} if restart else (checkpoint_ref.get().to_dict() or {})
+    stats = {key: checkpoint.get(key, 0) for key in ("copied", "skipped", "deleted")}
+
+    query = db.collection(FLAT_COLLECTION).order_by("__name__").limit(page_size)
+    last_doc = None
+    if checkpoint.get("last_doc_id"):
+        last_doc = flat_ref(checkpoint["last_doc_id"]).get()
+        if not last_doc.exists:
+            # The checkpointed document was deleted (e.g. by --delete-source); resume
+            # from its id, which is all the cursor needs
+            last_doc = {"__name__": flat_ref(checkpoint["last_doc_id"])}
+        print(f"Resuming after {checkpoint['last_doc_id']} ({stats['copied']} copied so far)")
+
+    options = BulkWriterOptions(initial_ops_per_second=rate, max_ops_per_second=rate)
+    started = time.perf_counter()
+    while True:
+        page = query.start_after(last_doc) if last_doc is not None else query
+        docs = list(page.stream())
+        if not docs:
+            break
+
+        writer = db.bulk_writer(options=options)
+        copied = []
+        for doc in docs:
+            data = doc.to_dict()
+            user_id = data.get("user_id")
+            if not user_id:
+                stats["skipped"] += 1
+                continue
+            copy_to_shard(user_id, doc.id, data, writer=writer)
+            copied.append(doc)
+        writer.close()
+
+        # Only after the copies are durable
+        if delete_source and copied:
+            writer = db.bulk_writer(options=options)
+            for doc in copied:
+                writer.delete(doc.reference)
+            writer.close()
+            stats["deleted"] += len(copied)
+
+        stats["copied"] += len(copied)
+        last_doc = docs[-1]
+        checkpoint_ref.set({
+            **stats,
+            "last_doc_id": last_doc.id,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+        print(f"Copied {stats['copied']} receipts, skipped {stats['skipped']} (at {last_doc.id})")
+
+        if len(docs) < page_size:
+            break
+
+    checkpoint_ref.set({"completed_at": firestore.SERVER_TIMESTAMP}, merge=True)
+    stats["duration_seconds"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy extracted_texts receipts into users/{uid}/receipts")
+    parser.add_argument("--rate", type=int, default=200, help="Maximum writes per second")
+    parser.add_argument("--page-size", type=int, default=300, help="Source documents read per page")
+    parser.add_argument("--delete-source", action="store_true", help="Delete each flat copy once copied (sharded mode only)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the beginning")
+    args = parser.parse_args()
+    print(migrate_receipts(args.rate, args.page_size, args.delete_source, args.restart))
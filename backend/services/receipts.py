@@ -0,0 +1,178 @@
+import os
+from typing import Iterator, Optional, Tuple
+
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.rpc import code_pb2
+
+from init import get_db
+
+# Where receipts live:
+#   legacy   the flat extracted_texts collection only
+#   dual     users/{uid}/receipts is written alongside extracted_texts (cutover mode).
+#            Reads still come from extracted_texts, falling back to the user's
+#            subcollection for a receipt that has no flat copy.
+#   sharded  users/{uid}/receipts only
+# extracted_texts stays the landing collection for the text-extraction trigger in
+# every mode; receipts are copied into the user's subcollection once linked. The
+# copy is a snapshot: the trigger's later writes (structured_output, status) only
+# reach extracted_texts, which is why dual mode reads from there. Only switch to
+# sharded once the trigger writes to users/{uid}/receipts itself.
+RECEIPT_STORAGE_MODE = os.getenv("RECEIPT_STORAGE_MODE", "dual").lower()
+
+FLAT_COLLECTION = "extracted_texts"
+SHARD_COLLECTION = "receipts"
+# BulkWriter's own retry limit for failed writes
+MAX_WRITE_ATTEMPTS = 15
+
+
+def reads_sharded() -> bool:
+    return RECEIPT_STORAGE_MODE in ("dual", "sharded")
+
+
+def reads_flat() -> bool:
+    return RECEIPT_STORAGE_MODE in ("legacy", "dual")
+
+
+def flat_ref(receipt_id: str):
+    return get_db().collection(FLAT_COLLECTION).document(receipt_id)
+
+
+def sharded_ref(user_id: str, receipt_id: str):
+    return get_db().collection("users").document(user_id).collection(SHARD_COLLECTION).document(receipt_id)
+
+
+def receipt_refs(receipt_id: str, user_id: Optional[str] = None) -> list:
+    """Every copy of a receipt that writes should go to under the current mode."""
+    refs = []
+    if user_id and reads_sharded():
+        refs.append(sharded_ref(user_id, receipt_id))
+    if reads_flat() or not user_id:
+        refs.append(flat_ref(receipt_id))
+    return refs
+
+
+def all_receipt_refs(receipt_id: str, user_id: Optional[str] = None) -> list:
+    """Both possible copies of a receipt, for deletes (deleting a missing document is a no-op)."""
+    refs = [flat_ref(receipt_id)]
+    if user_id:
+        refs.append(sharded_ref(user_id, receipt_id))
+    return refs
+
+
+def get_receipt(receipt_id: str, user_id: Optional[str] = None):
+    """
+    Returns the receipt's snapshot, or None. Without a user_id a sharded-only lookup
+    goes through a collection-group query on the receipt_id field.
+    """
+    if reads_flat():
+        snapshot = flat_ref(receipt_id).get()
+        if snapshot.exists:
+            return snapshot
+    if reads_sharded():
+        if user_id:
+            snapshot = sharded_ref(user_id, receipt_id).get()
+            if snapshot.exists:
+                return snapshot
+        elif not reads_flat():
+            matches = (
+                get_db().collection_group(SHARD_COLLECTION)
+                .where(filter=FieldFilter("receipt_id", "==", receipt_id))
+                .limit(1)
+                .get()
+            )
+            return matches[0] if matches else None
+    return None
+
+
+def _retry_unless_missing(failure, writer) -> bool:
+    return failure.code != code_pb2.NOT_FOUND and failure.attempts < MAX_WRITE_ATTEMPTS
+
+
+def receipt_writer():
+    """
+    A BulkWriter for receipt updates that drops updates to copies that do not exist
+    (e.g. a user not migrated in dual mode) instead of retrying them.
+    """
+    writer = get_db().bulk_writer()
+    writer.on_write_error(_retry_unless_missing)
+    return writer
+
+
+def update_receipt(receipt_id: str, user_id: Optional[str], fields: dict, writer=None):
+    """
+    Applies an update to every live copy of a receipt, skipping copies that do not
+    exist yet. With a writer from receipt_writer() the updates are added to it;
+    otherwise each copy is updated directly.
+    """
+    for ref in receipt_refs(receipt_id, user_id):
+        if writer is not None:
+            writer.update(ref, fields)
+            continue
+        try:
+            ref.update(fields)
+        except NotFound:
+            pass
+
+
+def copy_to_shard(user_id: str, receipt_id: str, data: dict, writer=None):
+    """Writes a receipt into users/{uid}/receipts, keeping its id and adding a receipt_id field."""
+    if not reads_sharded():
+        return
+    ref = sharded_ref(user_id, receipt_id)
+    data = {**data, "receipt_id": receipt_id, "user_id": user_id}
+    if writer is not None:
+        writer.set(ref, data)
+    else:
+        ref.set(data)
+
+
+def _paged(query, page_size: int) -> Iterator:
+    query = query.order_by("__name__").limit(page_size)
+    last_doc = None
+    while True:
+        page = query.start_after(last_doc) if last_doc is not None else query
+        docs = list(page.stream())
+        yield from docs
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+
+def stream_user_receipts(user_id: str, page_size: int = 200) -> Iterator[Tuple[str, dict]]:
+    """
+    Yields (doc_id, data) for every receipt of a user, one Firestore page at a time.
+    Pages are fetched with a document-id cursor so memory use does not grow with the
+    number of receipts. In dual mode receipts are read from extracted_texts, then
+    from the user's subcollection for any whose flat copy no longer exists.
+    """
+    seen = set()
+    if reads_flat():
+        flat = get_db().collection(FLAT_COLLECTION).where(filter=FieldFilter("user_id", "==", user_id))
+        for doc in _paged(flat, page_size):
+            if reads_sharded():
+                seen.add(doc.id)
+            yield doc.id, doc.to_dict()
+    if reads_sharded():
+        shard = get_db().collection("users").document(user_id).collection(SHARD_COLLECTION)
+        for doc in _paged(shard, page_size):
+            if doc.id not in seen:
+                yield doc.id, doc.to_dict()
+
+
+def stream_all_receipts(page_size: int = 200) -> Iterator[Tuple[str, dict]]:
+    if RECEIPT_STORAGE_MODE == "sharded":
+        source = get_db().collection_group(SHARD_COLLECTION)
+    else:
+        source = get_db().collection(FLAT_COLLECTION)
+    for doc in _paged(source, page_size):
+        yield doc.id, doc.to_dict()
+
+
+def expired_receipts_query(now, limit: int):
+    """Receipts whose expires_at has passed, oldest first."""
+    if RECEIPT_STORAGE_MODE == "sharded":
+        source = get_db().collection_group(SHARD_COLLECTION)
+    else:
+        source = get_db().collection(FLAT_COLLECTION)
+    return source.where(filter=FieldFilter("expires_at", "<=", now)).order_by("expires_at").limit(limit)
@@ -0,0 +1,259 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from firebase_admin import firestore
+
+from init import get_db
+from services.default import parse_amount, parse_receipt_date, parse_structured_output
+from services.receipts import stream_user_receipts, update_receipt
+
+# Per-user inverted index: one posting document per (term, receipt) at
+#   users/{uid}/similarity_terms/{term}/receipts/{receipt_id}
+#   {"price": 120.0, "date": "2025-07-21", "shop_name": "...", "indexed_at": ...}
+# Postings are separate documents so a common term ("token:milk", a regular shop)
+# can have any number of receipts without growing one document towards Firestore's
+# size and index-entry limits. Term documents themselves are never written.
+TERMS_COLLECTION = "similarity_terms"
+POSTINGS_COLLECTION = "receipts"
+# Most recent postings read per term when matching; older purchases of very common
+# terms are left out rather than reading them all
+MAX_POSTINGS_PER_TERM = 100
+# Item words only add a little to the score, so far fewer of their postings are read,
+# and none once the merchant and item terms have found enough matches
+MAX_POSTINGS_PER_TOKEN = 10
+LOOKUP_WORKERS = 16
+# Stored on users/{uid}; users indexed under an older layout (or never) are rebuilt
+# in the background on their first lookup
+INDEX_VERSION = 2
+# How long a rebuild holds its claim on the user; a lookup after that starts another
+# in case the first one died
+REBUILD_LEASE = timedelta(minutes=15)
+
+MERCHANT_WEIGHT = 2.0
+ITEM_WEIGHT = 1.0
+TOKEN_WEIGHT = 0.25
+MIN_TOKEN_LENGTH = 3
+BATCH_SIZE = 400
+
+# Pack sizes and units that say nothing about what was bought
+_NOISE_TOKENS = {"kg", "g", "gm", "gms", "ml", "l", "ltr", "pc", "pcs", "pkt", "nos", "x", "qty"}
+
+
+def normalize_name(name) -> str:
+    text = str(name or "").lower()
+    text = re.sub(r"[^a-z0-9 ]+", " ", text)
+    tokens = [t for t in text.split() if not t.isdigit() and t not in _NOISE_TOKENS]
+    # "500g" / "2pcs" style tokens
+    tokens = [t for t in tokens if not re.fullmatch(r"\d+[a-z]{0,3}", t)]
+    return " ".join(tokens)
+
+
+def _term_id(kind: str, value: str) -> str:
+    return f"{kind}:{value.replace(' ', '_')}"[:500]
+
+
+def receipt_terms(receipt: dict) -> Dict[str, Optional[float]]:
+    """
+    Maps each index term of a receipt to the price paid for it (None for merchant and
+    token terms, and for items without an amount).
+    """
+    terms = {}
+    shop = normalize_name(receipt.get("shop_name"))
+    if shop:
+        terms[_term_id("shop", shop)] = None
+
+    for item in receipt.get("items") or []:
+        if isinstance(item, dict):
+            name, price = item.get("name"), parse_amount(item.get("amount"))
+        else:
+            name, price = item, None
+        normalized = normalize_name(name)
+        if not normalized:
+            continue
+        terms[_term_id("item", normalized)] = price
+        for token in normalized.split():
+            if len(token) >= MIN_TOKEN_LENGTH:
+                terms.setdefault(_term_id("token", token), None)
+    return terms
+
+
+def _terms_ref(user_id: str):
+    return get_db().collection("users").document(user_id).collection(TERMS_COLLECTION)
+
+
+def _posting_ref(terms_ref, term: str, receipt_id: str):
+    return terms_ref.document(term).collection(POSTINGS_COLLECTION).document(receipt_id)
+
+
+def index_receipt(user_id: str, receipt_id: str, receipt_data: dict) -> int:
+    """Adds a receipt to its owner's similarity index. Returns the number of terms written."""
+    receipt = parse_structured_output(receipt_data.get("structured_output"))
+    if not receipt:
+        return 0
+
+    terms = receipt_terms(receipt)
+    db = get_db()
+    terms_ref = _terms_ref(user_id)
+    term_ids = list(terms)
+    for start in range(0, len(term_ids), BATCH_SIZE):
+        batch = db.batch()
+        for term in term_ids[start:start + BATCH_SIZE]:
+            batch.set(_posting_ref(terms_ref, term, receipt_id), {
+                "price": terms[term],
+                "date": receipt.get("date"),
+                "shop_name": receipt.get("shop_name"),
+                "indexed_at": firestore.SERVER_TIMESTAMP,
+            })
+        batch.commit()
+
+    # Remember the terms so the receipt can be removed from the index later
+    update_receipt(receipt_id, user_id, {"similarity_terms": term_ids})
+    return len(term_ids)
+
+
+def unindex_receipt(user_id: str, receipt_id: str, term_ids: List[str], batch=None):
+    """
+    Removes a receipt from the index. When a batch or BulkWriter is given the deletes
+    are added to it and the caller commits; otherwise they are committed here.
+    """
+    own_batch = batch is None
+    batch = batch or get_db().batch()
+    terms_ref = _terms_ref(user_id)
+    for term in term_ids:
+        batch.delete(_posting_ref(terms_ref, term, receipt_id))
+    if own_batch and term_ids:
+        batch.commit()
+
+
+def _user_ref(user_id: str):
+    return get_db().collection("users").document(user_id)
+
+
+def index_is_current(user_id: str) -> bool:
+    user_doc = _user_ref(user_id).get()
+    return (user_doc.to_dict() or {}).get("similarity_index_version") == INDEX_VERSION
+
+
+@firestore.transactional
+def _claim_rebuild(transaction, user_ref, force: bool) -> bool:
+    now = datetime.now(timezone.utc)
+    snapshot = user_ref.get(transaction=transaction)
+    data = snapshot.to_dict() or {}
+    if not force and data.get("similarity_index_version") == INDEX_VERSION:
+        return False
+    claimed_until = data.get("similarity_index_rebuild_until")
+    if claimed_until and claimed_until > now:
+        return False
+    transaction.set(user_ref, {"similarity_index_rebuild_until": now + REBUILD_LEASE}, merge=True)
+    return True
+
+
+def claim_index_rebuild(user_id: str, force: bool = False) -> bool:
+    """
+    Claims the rebuild of a user's index, so concurrent lookups start it only once.
+    False when another rebuild holds the claim or, unless forced, the index is current.
+    The caller then runs rebuild_user_index, which releases the claim.
+    """
+    return _claim_rebuild(get_db().transaction(), _user_ref(user_id), force)
+
+
+def rebuild_user_index(user_id: str) -> int:
+    """Re-indexes all of a user's receipts under the current layout. Returns the number indexed."""
+    try:
+        # Term documents only ever held the old single-map index; deleting them keeps
+        # the posting subcollections and does not read the maps
+        writer = get_db().bulk_writer()
+        for term_ref in _terms_ref(user_id).list_documents():
+            writer.delete(term_ref)
+        writer.close()
+
+        indexed = 0
+        for receipt_id, data in stream_user_receipts(user_id):
+            if index_receipt(user_id, receipt_id, data):
+                indexed += 1
+        _user_ref(user_id).set({"similarity_index_version": INDEX_VERSION}, merge=True)
+        return indexed
+    finally:
+        _user_ref(user_id).set({"similarity_index_rebuild_until": firestore.DELETE_FIELD}, merge=True)
+
+
+def _term_weight(term: str) -> float:
+    if term.startswith("shop:"):
+        return MERCHANT_WEIGHT
+    if term.startswith("item:"):
+        return ITEM_WEIGHT
+    return TOKEN_WEIGHT
+
+
+def find_similar(user_id: str, receipt_id: str, receipt: dict, limit: int = 10) -> List[dict]:
+    """
+    Ranks the user's other receipts by weighted shared terms (merchant, exact item,
+    item word) and reports price changes for items bought on both, from the earlier
+    purchase to the later one. Item words are only looked up when the merchant and
+    exact items match fewer than `limit` receipts.
+    """
+    terms = receipt_terms(receipt)
+    if not terms:
+        return []
+
+    terms_ref = _terms_ref(user_id)
+    receipt_date = parse_receipt_date(receipt.get("date"))
+
+    def postings(term: str):
+        query = (
+            terms_ref.document(term).collection(POSTINGS_COLLECTION)
+            .order_by("indexed_at", direction=firestore.Query.DESCENDING)
+            .limit(MAX_POSTINGS_PER_TOKEN if term.startswith("token:") else MAX_POSTINGS_PER_TERM)
+        )
+        return term, [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    strong_terms = [term for term in terms if not term.startswith("token:")]
+    token_terms = [term for term in terms if term.startswith("token:")]
+    with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+        results = list(executor.map(postings, strong_terms))
+        matched = {other_id for _, entries in results for other_id, _ in entries if other_id != receipt_id}
+        if len(matched) < limit:
+            results += executor.map(postings, token_terms)
+
+    matches = {}
+    for term, entries in results:
+        weight = _term_weight(term)
+        for other_id, entry in entries:
+            if other_id == receipt_id:
+                continue
+            match = matches.setdefault(other_id, {
+                "receipt_id": other_id,
+                "shop_name": entry.get("shop_name"),
+                "date": entry.get("date"),
+                "score": 0.0,
+                "same_merchant": False,
+                "matched_items": [],
+                "price_changes": [],
+            })
+            match["score"] += weight
+            if term.startswith("shop:"):
+                match["same_merchant"] = True
+            elif term.startswith("item:"):
+                item_name = term[len("item:"):].replace("_", " ")
+                match["matched_items"].append(item_name)
+                current_price, previous_price = terms[term], entry.get("price")
+                # This receipt counts as the later purchase unless the other one is dated after it
+                other_date = parse_receipt_date(entry.get("date"))
+                if receipt_date and other_date and other_date > receipt_date:
+                    current_price, previous_price = previous_price, current_price
+                if current_price is not None and previous_price is not None:
+                    change = round(current_price - previous_price, 2)
+                    match["price_changes"].append({
+                        "item": item_name,
+                        "previous_price": previous_price,
+                        "current_price": current_price,
+                        "change": change,
+                        "change_pct": round(change / previous_price * 100, 1) if previous_price else None,
+                    })
+
+    ranked = sorted(matches.values(), key=lambda m: m["score"], reverse=True)
+    for match in ranked:
+        match["score"] = round(match["score"], 2)
+    return ranked[:limit]
@@ -0,0 +1,114 @@
+import asyncio
+import functools
+import inspect
+import threading
+from typing import Callable, Dict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key runs the function,
+    callers arriving while it is in flight wait for it and get the same result (or
+    exception). Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[tuple, _Call] = {}
+        self._tasks: Dict[tuple, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, name: str, field: str):
+        stats = self._stats.setdefault(name, {"calls": 0, "executed": 0, "coalesced": 0, "errors": 0})
+        stats[field] += 1
+
+    def do(self, key: tuple, fn: Callable, *args, **kwargs):
+        name = key[0]
+        with self._lock:
+            self._count(name, "calls")
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._count(name, "executed")
+            else:
+                self._count(name, "coalesced")
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self._count(name, "errors")
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key: tuple, fn: Callable, *args, **kwargs):
+        name = key[0]
+        with self._lock:
+            self._count(name, "calls")
+            task = self._tasks.get(key)
+            if task is None:
+                task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+                self._count(name, "executed")
+                task.add_done_callback(lambda t: self._finish(key, t))
+            else:
+                self._count(name, "coalesced")
+        # Shielded so one client disconnecting does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, key: tuple, task: asyncio.Task):
+        with self._lock:
+            self._tasks.pop(key, None)
+            if task.cancelled() or task.exception() is not None:
+                self._count(key[0], "errors")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._stats.items()}
+
+
+flights = SingleFlight()
+
+
+def single_flight(name: str):
+    """
+    Decorator that coalesces concurrent calls with the same arguments. Works on sync and
+    async functions, and keeps the signature so it can sit under a FastAPI route decorator.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def make_key(args, kwargs) -> tuple:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return (name,) + tuple(sorted((k, repr(v)) for k, v in bound.arguments.items()))
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                return await flights.do_async(make_key(args, kwargs), fn, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return flights.do(make_key(args, kwargs), fn, *args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,81 @@
+import pytest
+
+import services.ingest_queue as ingest_queue
+from services.ingest_queue import IngestQueue, QueueFull
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return IngestQueue(str(tmp_path / "queue.db"))
+
+
+def expire_leases(queue):
+    queue._connect().execute("UPDATE jobs SET lease_until = 0 WHERE state = 'running'")
+
+
+def test_advance_moves_claimed_job_to_next_stage(queue):
+    job_id = queue.enqueue("user-1", {"spool_key": "k"})
+    job = queue.claim("store")
+
+    assert job["id"] == job_id
+    assert queue.claim("store") is None
+    assert queue.advance(job, {**job["payload"], "file_url": "u"})
+
+    stored = queue.get(job_id)
+    assert (stored["stage"], stored["state"]) == ("wait_extraction", "ready")
+    assert stored["payload"]["file_url"] == "u"
+
+
+def test_stale_advance_after_reclaim_is_dropped(queue):
+    job_id = queue.enqueue("user-1", {})
+    stale = queue.claim("store")
+
+    expire_leases(queue)
+    assert queue.requeue_expired_leases() == (1, 0)
+    current = queue.claim("store")
+    assert current["id"] == job_id
+
+    assert queue.advance(current, {"by": "current"})
+    assert not queue.advance(stale, {"by": "stale"})
+    assert not queue.fail(stale, "boom")
+
+    stored = queue.get(job_id)
+    assert (stored["stage"], stored["state"]) == ("wait_extraction", "ready")
+    assert stored["payload"] == {"by": "current"}
+
+
+def test_lost_leases_count_towards_dead_letter(queue, monkeypatch):
+    monkeypatch.setattr(ingest_queue, "MAX_ATTEMPTS", 2)
+    job_id = queue.enqueue("user-1", {})
+
+    queue.claim("store")
+    expire_leases(queue)
+    assert queue.requeue_expired_leases() == (1, 0)
+
+    queue.claim("store")
+    expire_leases(queue)
+    assert queue.requeue_expired_leases() == (0, 1)
+    assert queue.get(job_id)["state"] == "dead"
+
+
+def test_fail_backs_off_then_dead_letters(queue, monkeypatch):
+    monkeypatch.setattr(ingest_queue, "MAX_ATTEMPTS", 2)
+    job_id = queue.enqueue("user-1", {})
+
+    assert queue.fail(queue.claim("store"), "boom")
+    retried = queue.get(job_id)
+    assert (retried["state"], retried["attempts"]) == ("ready", 1)
+    assert queue.claim("store") is None  # still backing off
+
+    queue._connect().execute("UPDATE jobs SET next_run_at = 0")
+    assert queue.fail(queue.claim("store"), "boom")
+    assert queue.get(job_id)["state"] == "dead"
+    assert queue.redrive(job_id)
+    assert queue.get(job_id)["state"] == "ready"
+
+
+def test_enqueue_rejects_when_full(queue, monkeypatch):
+    monkeypatch.setattr(ingest_queue, "MAX_QUEUE_DEPTH", 1)
+    queue.enqueue("user-1", {})
+    with pytest.raises(QueueFull):
+        queue.enqueue("user-1", {})